@@ -29,13 +29,15 @@
 #------------------------------------------------------------------------------
 
 from weyland import LANGUAGES, LEXERS
+import weyland
+from collections import OrderedDict
 from datetime import datetime
 from typing import List
+import hashlib
 import time
 import traceback
 import os.path
 import json
-import math
 import sys
 import os
 import re
@@ -54,6 +56,260 @@ END_PARAGRAPH = "</p>\n"
 class HamillException(Exception):
     pass
 
+# Highlighting
+
+class HighlightCache:
+    """LRU cache of the HTML produced by weyland for a (language, content, raws, compact) key. A size of 0 disables it.
+       A HighlightStore can be set as a second level, on disk."""
+
+    def __init__(self, size = 1024):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.store = None # HighlightStore on disk
+
+    def set_size(self, size):
+        self.size = size
+        while len(self.entries) > max(size, 0):
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def set_store(self, store):
+        """Set a HighlightStore checked on a miss, None to remove it"""
+        self.store = store
+
+    def highlight(self, lang, content, raws, compact = False):
+        # The lexer is in the key: a lexer set in LEXERS for lang never gets the HTML of the previous one
+        key = (LEXERS[lang], content, tuple(raws), compact)
+        if self.size > 0 and key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.misses += 1
+        output = None if self.store is None else self.store.get(lang, content, raws, compact)
+        if output is None:
+            output = LEXERS[lang].to_html(content, None, raws, compact)
+            if self.store is not None:
+                self.store.set(lang, content, raws, compact, output)
+        if self.size > 0:
+            self.entries[key] = output
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return output
+
+    def stats(self):
+        stats = {"size": self.size, "entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+        if self.store is not None:
+            stats["store"] = self.store.stats()
+        return stats
+
+class HighlightStore:
+    """Cache of the HTML produced by weyland on disk, kept between builds and shared by processes.
+
+    Each entry is a file in a sub directory of directory, named by the hash of the weyland version,
+    the definitions of the language of the lexer and its engine, the raws, compact and the content. A file is written then renamed
+    so a reader never sees a partial entry. A hit touches its file. When the size of the files goes over
+    max_size, the least recently used are removed, with the temporary files left by a crashed writer.
+    Each process counts what it writes and checks the real size on disk before removing anything,
+    so the cap is exceeded at most by the writes between two checks.
+    """
+
+    # Size in bytes of the files by default
+    MAX_SIZE = 64 * 1024 * 1024
+
+    # After a pruning, the files take at most this fraction of max_size
+    PRUNE_RATIO = 0.8
+
+    # A temporary file older than this number of seconds is not being written anymore
+    TEMP_AGE = 3600
+
+    def __init__(self, directory, max_size = MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.size = None # estimation of the size of the files, None before the first write
+        self.definitions = {} # {lexer: hash of the definitions of its language, engine}
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def get_definitions(self, lang):
+        lexer = LEXERS[lang]
+        if lexer not in self.definitions:
+            from weyland import tables
+            self.definitions[lexer] = (tables.definitions_hash(lexer.get_language()), lexer.engine)
+        return self.definitions[lexer]
+
+    def get_path(self, lang, content, raws, compact):
+        key = repr((weyland.__version__, self.get_definitions(lang), lang, tuple(raws), compact, content))
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest[2:] + '.html')
+
+    def get(self, lang, content, raws, compact = False):
+        """Return the HTML saved for this code, None if there is none"""
+        path = self.get_path(lang, content, raws, compact)
+        try:
+            with open(path, 'r', encoding='utf-8', newline='') as f:
+                output = f.read()
+            os.utime(path)
+        except OSError:
+            # Missing, or removed by another process between the read and the touch
+            self.misses += 1
+            return None
+        self.hits += 1
+        return output
+
+    def set(self, lang, content, raws, compact, output):
+        path = self.get_path(lang, content, raws, compact)
+        data = output.encode('utf-8')
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp = f'{path}.{os.getpid()}.tmp'
+            with open(temp, 'wb') as f:
+                f.write(data)
+            os.replace(temp, path)
+        except OSError:
+            self.errors += 1
+            return
+        if self.size is None:
+            self.size = self.get_size()
+        else:
+            self.size += len(data)
+        if self.size > self.max_size:
+            self.prune()
+
+    def get_entries(self, suffix = '.html'):
+        """Return the (time of last use, size, path) of the files ending with suffix"""
+        entries = []
+        try:
+            shards = [entry.path for entry in os.scandir(self.directory) if entry.is_dir()]
+        except OSError:
+            return entries
+        for shard in shards:
+            try:
+                for entry in os.scandir(shard):
+                    if entry.name.endswith(suffix):
+                        info = entry.stat()
+                        entries.append((info.st_mtime, info.st_size, entry.path))
+            except OSError:
+                pass # removed by another process
+        return entries
+
+    def get_size(self):
+        return sum(size for _, size, _ in self.get_entries())
+
+    def remove_temps(self, age = TEMP_AGE):
+        """Remove the temporary files not modified for age seconds"""
+        limit = time.time() - age
+        for modified, _, path in self.get_entries('.tmp'):
+            if modified < limit:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass # already removed by another process
+
+    def prune(self):
+        """Remove the least recently used files until they take at most PRUNE_RATIO of max_size"""
+        self.remove_temps()
+        entries = sorted(self.get_entries())
+        size = sum(size for _, size, _ in entries)
+        target = self.max_size * HighlightStore.PRUNE_RATIO
+        for _, length, path in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass # already removed by another process
+            size -= length
+        self.size = size
+
+    def clear(self):
+        self.remove_temps()
+        for _, _, path in self.get_entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.size = 0
+
+    def stats(self):
+        return {"directory": self.directory, "max_size": self.max_size, "hits": self.hits, "misses": self.misses, "errors": self.errors}
+
+# Shared by all the documents. Use HIGHLIGHT_CACHE.set_size(0) to turn it off.
+HIGHLIGHT_CACHE = HighlightCache()
+
+# Set HAMILL_CACHE_DIR to keep the highlighted code on disk between runs
+if os.environ.get('HAMILL_CACHE_DIR'):
+    HIGHLIGHT_CACHE.set_store(HighlightStore(os.environ['HAMILL_CACHE_DIR']))
+
+# Inline parsing
+
+class InlineCache:
+    """LRU cache of the nodes produced by Hamill.scan_inner_string for a string. A size of 0 disables it.
+       Results with ids are not kept: their ids must be registered again in the document at each parse."""
+
+    def __init__(self, size = 4096):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.with_ids = 0
+
+    def set_size(self, size):
+        self.size = size
+        while len(self.entries) > max(size, 0):
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.with_ids = 0
+
+    @staticmethod
+    def copy(nodes, document):
+        """Copy the nodes for document. The first node of a table cell loses its markers so nodes are never shared."""
+        copies = []
+        for node in nodes:
+            copy = object.__new__(node.__class__)
+            copy.__dict__.update(node.__dict__)
+            copy.document = document
+            if isinstance(node, Link) and node.display is not None:
+                copy.display = InlineCache.copy(node.display, document)
+            copies.append(copy)
+        return copies
+
+    def parse(self, document, s):
+        if self.size <= 0:
+            return Hamill.scan_inner_string(document, s)
+        if s in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(s)
+            return InlineCache.copy(self.entries[s], document)
+        self.misses += 1
+        registered = len(document.ids)
+        nodes = Hamill.scan_inner_string(document, s)
+        if len(document.ids) != registered:
+            self.with_ids += 1
+        else:
+            self.entries[s] = InlineCache.copy(nodes, None) # don't keep the document alive
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return nodes
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"size": self.size, "entries": len(self.entries), "hits": self.hits, "misses": self.misses,
+                "with_ids": self.with_ids, "hit_rate": self.hits / total if total > 0 else 0.0}
+
+# Shared by all the documents. Use INLINE_CACHE.set_size(0) to turn it off.
+INLINE_CACHE = InlineCache()
+
 # Tagged lines
 
 class Line:
@@ -186,9 +442,11 @@ class Comment(Node):
 
 class Row(EmptyNode):
 
-    def __init__(self, document, node_list_list):
+    def __init__(self, document, node_list_list, cells = None):
         super().__init__(document)
         self.node_list_list = node_list_list
+        # alignment and span of each cell, see Hamill.parse_inner_cell
+        self.cells = cells if cells is not None else [Hamill.parse_inner_cell(nodes) for nodes in node_list_list]
         self.is_header = False
 
 class RawHTML(Node):
@@ -408,7 +666,8 @@ class Code(Node):
         output = self.content
         lang = self.document.get_variable("DEFAULT_CODE", "") if self.lang is None else self.lang
         if lang is not None and lang != "" and lang in LANGUAGES:
-            output = LEXERS[lang].to_html(self.content, None, ["blank"])
+            compact = self.document.get_variable("COMPACT_CODE", False)
+            output = HIGHLIGHT_CACHE.highlight(lang, self.content, ["blank"], compact)
         if self.inline:
             return "<code>" + output + "</code>"
         else:
@@ -513,6 +772,7 @@ class Document:
             Variable(self, "PARAGRAPH_DEFINITION", "boolean", False),
             Variable(self, "EXPORT_COMMENT", "boolean", False),
             Variable(self, "DEFAULT_CODE", "string"),
+            Variable(self, "COMPACT_CODE", "boolean", False),
             Constant(self, "BODY_CLASS", "string"),
             Constant(self, "BODY_ID", "string"),
             Variable(self, "NEXT_TABLE_CLASS", "string"),
@@ -833,39 +1093,16 @@ class Document:
                         self.set_variable("NEXT_TABLE_ID", None) # reset if found
                     i1s = f' id="{i1}"' if i1 is not None and i1 != "" else ""
                     content += f'<table{i1s}{cs}>\n'
-                content += "<tr>"
                 delim = "th" if node.is_header else "td"
-                for node_list in node.node_list_list:
-                    center = ""
-                    span = ""
-                    if len(node_list) > 0 and isinstance(node_list[0], Node) and len(node_list[0].content) > 0 and node_list[0].content[0] == "=":
-                        node_list[0].content = node_list[0].content[1:]
-                        center = ' style="text-align: center"'
-                    elif len(node_list) > 0 and isinstance(node_list[0], Node) and len(node_list[0].content) > 0 and node_list[0].content[0] == ">":
-                        node_list[0].content = node_list[0].content[1:]
-                        center = ' style="text-align: right"'
-                    if len(node_list) > 0 and isinstance(node_list[0], Node) and len(node_list[0].content) > 2 and node_list[0].content[0] == "#":
-                        if node_list[0].content[1] == 'c':
-                            span = ' colspan="'
-                        elif node_list[0].content[1] == 'r':
-                            span = ' rowspan="'
-                        if span != '':
-                            i = 2
-                            found  = False
-                            while i < len(node_list[0].content):
-                                if node_list[0].content[i] == '#':
-                                    found = True
-                                    break
-                                i += 1
-                            if not found:
-                                span = ''
-                            else:
-                                span += node_list[0].content[2 : i] + '"'
-                                node_list[0].content = node_list[0].content[i+1:]
-                    content += f'<{delim}{center}{span}>'
-                    content = self.string_to_html(content, node_list)
-                    content += f'</{delim}>'
-                content += "</tr>\n"
+                row = ["<tr>"] # the row is joined once: content is not copied for each cell
+                for node_list, cell in zip(node.node_list_list, node.cells):
+                    center = "" if cell["align"] is None else f' style="text-align: {cell["align"]}"'
+                    span = "" if cell["span"] is None else f' {cell["span"]}="{cell["span_value"]}"'
+                    row.append(f'<{delim}{center}{span}>')
+                    row.append(self.string_to_html("", node_list))
+                    row.append(f'</{delim}>')
+                row.append("</tr>\n")
+                content += "".join(row)
             elif skip_error:
                 not_processed += 1
                 if node.__class__.__name__ not in types_not_processed:
@@ -918,6 +1155,131 @@ class Document:
                     out += self.to_s(level + 1, n)
         return out
 
+# Line classifier. Hamill.tag_lines gives each stripped line to the tagger of its first character.
+# A tagger returns the Line or None for a text line.
+
+# States of tag_lines
+LINE_NORMAL = 0
+LINE_CODE = 1 # only the first and the last line start with @@@
+LINE_CODE_PREFIXED = 2 # each line must start with @@
+LINE_QUOTE = 3 # only the first and the last line start with >>>
+
+def tag_list(value, marker, type):
+    start = value.find(marker)
+    level = start // 2
+    if level * 2 != start:
+        raise HamillException("Level list must be indented by a multiple of two")
+    return Line(value, type, level + 1)
+
+def tag_title(value, trimmed):
+    return Line(trimmed, "title")
+
+def tag_dash(value, trimmed):
+    # HR: only dashes
+    if trimmed.strip("-") == "":
+        return Line("", "separator")
+    if trimmed[0:2] == "- ":
+        return tag_list(value, "- ", "reverse_list")
+    return None
+
+def tag_star(value, trimmed):
+    return tag_list(value, "* ", "unordered_list") if trimmed[0:2] == "* " else None
+
+def tag_plus(value, trimmed):
+    return tag_list(value, "+ ", "ordered_list") if trimmed[0:2] == "+ " else None
+
+# Prefix, type and True if the value of the line is stripped
+LINE_KEYWORDS = [
+    ("!var ", "var", True),
+    ("!const ", "const", True),
+    ("!include ", "include", True),
+    ("!require ", "require", True),
+    ("!css ", "css", False),
+    ("!html", "html", False),
+    ("!rem", "comment", True),
+]
+
+def tag_keyword(value, trimmed):
+    for prefix, type, stripped in LINE_KEYWORDS:
+        if trimmed.startswith(prefix):
+            return Line(trimmed if stripped else value, type)
+    return None
+
+def tag_comment(value, trimmed):
+    return Line(trimmed, "comment") if trimmed[0:2] == "§§" else None
+
+def tag_code(value, trimmed):
+    if trimmed[0:3] == "@@@" or (trimmed[0:2] == "@@" and "@@" not in trimmed[2:]):
+        return Line(value, "code")
+    return None
+
+def tag_quote(value, trimmed):
+    return Line(value, "quote") if trimmed[0:2] == ">>" else None
+
+def tag_label(value, trimmed):
+    return Line(trimmed, "label") if trimmed[0:2] == "::" else None
+
+def tag_div(value, trimmed):
+    # Si la ligne entière est {{ }}, c'est une div. On ne fait pas de span d'une ligne
+    if trimmed[0:2] == "{{" and trimmed.endswith("}}") and trimmed.rfind("{{") == 0:
+        return Line(trimmed, "div")
+    return None
+
+def tag_detail(value, trimmed):
+    if trimmed[0:2] == "<<" and trimmed.endswith(">>") and trimmed.rfind("<<") == 0:
+        return Line(trimmed, "detail")
+    return None
+
+def tag_row(value, trimmed):
+    return Line(trimmed, "row") if trimmed[-1] == "|" else None
+
+def tag_definition(value, trimmed):
+    return Line(trimmed[2:], "definition-header") if trimmed[0:2] == "$ " else None
+
+LINE_TAGGERS = {
+    "#": tag_title,
+    "-": tag_dash,
+    "*": tag_star,
+    "+": tag_plus,
+    "!": tag_keyword,
+    "§": tag_comment,
+    "@": tag_code,
+    ">": tag_quote,
+    ":": tag_label,
+    "{": tag_div,
+    "<": tag_detail,
+    "|": tag_row,
+    "$": tag_definition,
+}
+
+# Inline scanner. Hamill.parse_inner_string jumps from a delimiter to the next one and copies the text between as a whole.
+
+# Doubled characters opening an inline element or switching a text mode
+INLINE_MARKS = {
+    "@": "code",
+    "(": "picture",
+    "[": "link",
+    "{": "markup",
+    "$": "echo",
+    "*": "bold",
+    "!": "strong",
+    "'": "italic",
+    "/": "em",
+    "_": "underline",
+    "^": "sup",
+    "%": "sub",
+    "-": "stroke",
+}
+
+# A doubled mark or ## not preceded by \, or \\\ (escaped backslash)
+INLINE_DELIMITER = re.compile(r"(?<!\\)([@(\[{$*!'/_^%\-#])\1|\\\\\\")
+
+# \@ and \\ in inline code, replaced by the escaped character
+CODE_ESCAPES = re.compile(r"\\([@\\])")
+
+# Patterns of Hamill.escaped_split: the separator or the separator escaped by \
+SEPARATORS = {}
+
 class Hamill:
 
     VERSION = VERSION
@@ -946,7 +1308,7 @@ class Hamill:
             nline = line.replace("\n", "<NL>")
             print(f"    {index + 1}. {nline}")
         # Tag lines
-        tagged = Hamill.tag_lines(data.split("\n"))
+        tagged = Hamill.tag_lines(lines)
         print("\nTagged Lines:")
         for index, line in enumerate(tagged):
             print(f"    {index + 1}. {line}")
@@ -960,130 +1322,72 @@ class Hamill:
     # First pass: we tag all the lines
     @staticmethod
     def tag_lines(raw):
-        msg = "Level list must be indented by a multiple of two"
         lines = []
+        append = lines.append
         next_is_def = False
-        in_code_block = False # only the first and the last line start with @@@
-        in_code_block_prefixed = False # each line must start with @@
-        in_quote_block = False # only the first and the last line start with >>>
+        state = LINE_NORMAL
         for value in raw:
             trimmed = value.strip()
-            # Check states
-            # End of prefixed block
-            if in_code_block_prefixed and not trimmed.startswith('@@') and not trimmed.startswith('@@@'):
-                in_code_block_prefixed = False
-                # Final line @@@ of a not prefixed block
-            elif in_code_block and trimmed == '@@@':
-                in_code_block = False
+            # Blocks
+            if state == LINE_CODE_PREFIXED:
+                # End of prefixed block: each line must start with @@
+                if trimmed.startswith('@@'):
+                    append(Line(value, "code"))
+                    continue
+                state = LINE_NORMAL
+            elif state == LINE_CODE:
+                # Final line @@@ of a not prefixed block is dropped
+                if trimmed == '@@@':
+                    state = LINE_NORMAL
+                else:
+                    append(Line(value, "code"))
                 continue
-            elif in_quote_block and trimmed == '>>>':
-                in_quote_block = False
+            elif state == LINE_QUOTE:
+                if trimmed == '>>>':
+                    state = LINE_NORMAL
+                else:
+                    append(Line(value, "quote"))
                 continue
-
-            # States handling
-            if in_code_block or in_code_block_prefixed:
-                lines.append(Line(value, "code"))
-            elif in_quote_block:
-                lines.append(Line(value, "quote"))
-            elif len(trimmed) == 0:
-                lines.append(Line("", "empty"))
-                # Titles :
-            elif trimmed[0] == "#":
-                lines.append(Line(trimmed, "title"))
-            # HR :
-            elif len(re.findall("-", trimmed) or []) == len(trimmed):
-                lines.append(Line("", "separator"))
-            # Lists, line with the first non empty character is "* " or "+ " or "- " :
-            elif trimmed[0:2] == "* ":
-                start = value.find("* ")
-                level = math.trunc(start / 2)
-                if level * 2 != start:
-                    raise HamillException(msg)
-                lines.append(Line(value, "unordered_list", level + 1))
-            elif trimmed[0:2] == "+ ":
-                start = value.index("+ ")
-                level = math.trunc(start / 2)
-                if level * 2 != start:
-                    raise HamillException(msg)
-                lines.append(Line(value, "ordered_list", level + 1))
-            elif trimmed[0:2] == "- ":
-                start = value.index("- ")
-                level = math.trunc(start / 2)
-                if level * 2 != start:
-                    raise HamillException(msg)
-                lines.append(Line(value, "reverse_list", level + 1))
-            # Keywords, line with the first non empty character is "!" :
-            # var, const, include, require, css, html, comment
-            elif trimmed.startswith("!var "):
-                lines.append(Line(trimmed, "var"))
-            elif trimmed.startswith("!const "):
-                lines.append(Line(trimmed, "const"))
-            elif trimmed.startswith("!include "):
-                lines.append(Line(trimmed, "include"))
-            elif trimmed.startswith("!require "):
-                lines.append(Line(trimmed, "require"))
-            elif trimmed.startswith("!css "):
-                lines.append(Line(value, "css"))
-            elif trimmed.startswith("!html"):
-                lines.append(Line(value, "html"))
-            elif trimmed.startswith("!rem") or trimmed[0:2] == "§§":
-                lines.append(Line(trimmed, "comment"))
-            # Block of code
-            elif trimmed[0:3] == "@@@":
-                in_code_block = True
-                lines.append(Line(value, "code"))
-            elif trimmed[0:2] == "@@" and "@@" not in trimmed[2:]:
-                in_code_block_prefixed = True
-                lines.append(Line(value, "code"))
-            # Block of quote
-            elif trimmed[0:3] == ">>>":
-                in_quote_block = True # will be desactivate in Check states
-                lines.append(Line(value, "quote"))
-            elif trimmed[0:2] == ">>":
-                lines.append(Line(value, "quote"))
-            # Labels
-            elif trimmed[0:2] == "::":
-                lines.append(Line(trimmed, "label"))
-                # Div (Si la ligne entière est {{ }}, c'est une div. On ne fait pas de span d'une ligne)
-            elif trimmed[0:2] == "{{" and trimmed.endswith("}}") and trimmed.rfind("{{") == 0:
-                # span au début et à la fin = erreur
-                lines.append(Line(trimmed, "div"))
-                # Detail
-            elif trimmed[0:2] == "<<" and trimmed.endswith(">>") and trimmed.rfind("<<") == 0:
-                lines.append(Line(trimmed, "detail"))
-                # Tables
-            elif trimmed[0] == "|" and trimmed[-1] == "|":
-                lines.append(Line(trimmed, "row"))
-                # Definition lists
-            elif trimmed[0:2] == "$ ":
-                lines.append(Line(trimmed[2:], "definition-header"))
+            if len(trimmed) == 0:
+                append(Line("", "empty"))
+                continue
+            # Dispatch on the first character
+            tagger = LINE_TAGGERS.get(trimmed[0])
+            line = None if tagger is None else tagger(value, trimmed)
+            if line is None:
+                if not next_is_def:
+                    append(Line(trimmed, "text"))
+                else:
+                    append(Line(trimmed, "definition-content"))
+                    next_is_def = False
+                continue
+            append(line)
+            if line.type == "code":
+                state = LINE_CODE if trimmed[0:3] == "@@@" else LINE_CODE_PREFIXED
+            elif line.type == "quote" and trimmed[0:3] == ">>>":
+                state = LINE_QUOTE
+            elif line.type == "definition-header":
                 next_is_def = True
-            elif not next_is_def:
-                lines.append(Line(trimmed, "text"))
-            else:
-                lines.append(Line(trimmed, "definition-content"))
-                next_is_def = False
         return lines
 
     @staticmethod
     def escaped_split(sep, s):
+        pattern = SEPARATORS.get(sep)
+        if pattern is None:
+            pattern = SEPARATORS[sep] = re.compile(re.escape(sep) + "|" + re.escape("\\" + sep))
         parts = []
-        part = ""
-        index = 0
-        while index < len(s):
-            char = s[index]
-            try_sep = s[index : index + len(sep)]
-            nextc = s[index + 1 : index + 1 + len(sep)] if (index + 1) < len(s) else ""
-            if try_sep == sep:
-                parts.append(part)
-                part = ""
-                index += len(sep) - 1
-            elif char == "\\" and nextc == sep:
-                part += sep
-                index += len(sep)
+        part = [] # slices of the current part
+        last = 0
+        for found in pattern.finditer(s):
+            part.append(s[last:found.start()])
+            if found.end() - found.start() == len(sep):
+                parts.append("".join(part))
+                part = []
             else:
-                part += char
-            index += 1
+                part.append(sep)
+            last = found.end()
+        part.append(s[last:])
+        part = "".join(part)
         if len(part) > 0:
             parts.append(part)
         return parts
@@ -1277,10 +1581,12 @@ class Hamill:
                 else:
                     parts = Hamill.escaped_split("|", content); # Handle escape
                     all_nodes = []
+                    cells = []
                     for p in parts:
                         nodes = Hamill.parse_inner_string(doc, p)
                         all_nodes.append(nodes)
-                    doc.add_node(Row(doc, all_nodes))
+                        cells.append(Hamill.parse_inner_cell(nodes))
+                    doc.add_node(Row(doc, all_nodes, cells))
             elif line.type == "empty":
                 # Prevent multiple empty nodes
                 if len(doc.nodes) == 0 or type(doc.nodes[-1]) != EmptyNode:
@@ -1358,55 +1664,28 @@ class Hamill:
     @staticmethod
     def find(s, start, pattern):
         # String not big enough to have the motif
-        if len(pattern) > len(s[start:]):
+        if len(pattern) > len(s) - start:
             return -1
-        for i in range(start, len(s)):
-            if s[i:i + len(pattern)] == pattern:
-                if (i - 1 < start) \
-                    or (i - 1 >= start and s[i - 1] != "\\") \
-                    or (i - 2 < start) \
-                    or (i - 2 >= start and s[i - 1] == "\\" and s[i - 2] == "\\"):
-                    return i
+        i = s.find(pattern, start)
+        while i != -1 and i < len(s):
+            if i - 2 < start or s[i - 1] != "\\" or s[i - 2] == "\\":
+                return i
+            i = s.find(pattern, i + 1)
         return -1
 
     @staticmethod
     def unescape_code(s):
-        res = ""
-        i = 0
-        while i < len(s):
-            char = s[i]
-            nextc = s[i + 1] if i + 1 < len(s) else ""
-            if char == "\\" and nextc == '@':
-                res += "@"
-                i += 1
-            elif char == "\\" and nextc == "\\":
-                res += "\\"
-                i += 1
-            else:
-                res += char
-            i += 1
-        return res
+        return CODE_ESCAPES.sub(r"\1", s)
 
     @staticmethod
     def parse_inner_string(doc, s):
+        return INLINE_CACHE.parse(doc, s)
+
+    @staticmethod
+    def scan_inner_string(doc, s):
         index = 0
         word = ""
         nodes = []
-        matches = [
-            ["@", "@", "code"],
-            ["(", "(", "picture"],
-            ["[", "[", "link"],
-            ["{", "{", "markup"],
-            ["$", "$", "echo"],
-            ["*", "*", "bold"],
-            ["!", "!", "strong"],
-            ["'", "'", "italic"],
-            ["/", "/", "em"],
-            ["_", "_", "underline"],
-            ["^", "^", "sup"],
-            ["%", "%", "sub"],
-            ["-", "-", "stroke"],
-        ]
         modes = {
             "bold": False,
             "strong": False,
@@ -1420,138 +1699,133 @@ class Hamill:
         text_modifier_stack = []
 
         while index < len(s):
+            found = INLINE_DELIMITER.search(s, index)
+            if found is None:
+                word += s[index:]
+                break
+            # Plain text up to the delimiter
+            word += s[index:found.start()]
+            index = found.start()
             char = s[index]
-            nextc = s[index + 1] if index + 1 < len(s) else None
-            next_next = s[index + 2] if index + 2 < len(s) else None
-            prev = s[index - 1] if index - 1 >= 0 else None
             # Remplacement des glyphes
             # Glyphs - Quatuor
-            if char == "#" and nextc == "#" and prev != "\\":
+            if char == "#":
                 if len(word) > 0:
                     nodes.append(
                         Text(doc, word[0:].strip())
                     )
                     word = ""
                 nodes.append(BR(doc))
-                index += 1; # set on the second #
+                index += 2
                 # in case of a ## b, the first space is removed by strip() above
                 # and the second space by this :
-                if index + 1 < len(s) and s[index + 1] == ' ':
-                    index +=1
-            elif char == "\\" and nextc == "\\" and next_next == "\\":
+                if index < len(s) and s[index] == ' ':
+                    index += 1
+            elif char == "\\":
                 # escape it
                 word += "\\\\"
-                index += 4
+                index += 5
             # Text Styles
             else:
-                match = None
-                for pattern in matches:
-                    if char == pattern[0] and nextc == pattern[1] and prev != "\\":
-                        match = pattern[2]
-                        break
-                if match != None:
-                    if len(word) > 0:
-                        nodes.append(Text(doc, word))
-                        word = ""
-                    if match == "picture":
-                        end = s.index("))", index)
-                        if end == -1:
-                            raise HamillException(f"Unclosed image in {s}")
-                        content = s[index + 2:end]
-                        res = Hamill.parse_inner_picture(content)
+                match = INLINE_MARKS[char]
+                if len(word) > 0:
+                    nodes.append(Text(doc, word))
+                    word = ""
+                if match == "picture":
+                    end = s.index("))", index)
+                    if end == -1:
+                        raise HamillException(f"Unclosed image in {s}")
+                    content = s[index + 2:end]
+                    res = Hamill.parse_inner_picture(content)
+                    nodes.append(
+                        Picture(
+                            doc,
+                            res["url"],
+                            res["text"],
+                            res["class"],
+                            res["id"]
+                        )
+                    )
+                    index = end + 2
+                elif match == "link":
+                    end = s.find("]]", index)
+                    if end == -1:
+                        raise HamillException(f"Unclosed link in {s}")
+                    content = s[index + 2:end]
+                    parts = Hamill.escaped_split("->", content)
+                    display = None
+                    url = None
+                    if len(parts) == 1:
+                        url = parts[0].strip()
+                    elif len(parts) == 2:
+                        display = Hamill.parse_inner_string(
+                            doc,
+                            parts[0].strip()
+                        )
+                        url = parts[1].strip()
+                    elif len(parts) > 2:
+                        raise HamillException(f"Malformed link: {content}")
+                    nodes.append(Link(doc, url, display))
+                    index = end + 2
+                elif match == "markup":
+                    end = s.index("}}", index)
+                    if end == -1:
+                        raise HamillException(f"Unclosed markup in {s}")
+                    content = s[index + 2:end]
+                    res = Hamill.parse_inner_markup(content)
+                    if res["has_text"]:
                         nodes.append(
-                            Picture(
+                            Span(
                                 doc,
-                                res["url"],
                                 res["text"],
-                                res["class"],
-                                res["id"]
+                                res["id"],
+                                res["class"]
                             )
                         )
-                        index = end + 1
-                    elif match == "link":
-                        end = s.find("]]", index)
-                        if end == -1:
-                            raise HamillException(f"Unclosed link in {s}")
-                        content = s[index + 2:end]
-                        parts = Hamill.escaped_split("->", content)
-                        display = None
-                        url = None
-                        if len(parts) == 1:
-                            url = parts[0].strip()
-                        elif len(parts) == 2:
-                            display = Hamill.parse_inner_string(
+                    else:
+                        nodes.append(
+                            ParagraphIndicator(
                                 doc,
-                                parts[0].strip()
-                            )
-                            url = parts[1].strip()
-                        elif len(parts) > 2:
-                            raise HamillException(f"Malformed link: {content}")
-                        nodes.append(Link(doc, url, display))
-                        index = end + 1
-                    elif match == "markup":
-                        end = s.index("}}", index)
-                        if end == -1:
-                            raise HamillException(f"Unclosed markup in {s}")
-                        content = s[index + 2:end]
-                        res = Hamill.parse_inner_markup(content)
-                        if res["has_text"]:
-                            nodes.append(
-                                Span(
-                                    doc,
-                                    res["text"],
-                                    res["id"],
-                                    res["class"]
-                                )
+                                res["id"],
+                                res["class"]
                             )
-                        else:
-                            nodes.append(
-                                ParagraphIndicator(
-                                    doc,
-                                    res["id"],
-                                    res["class"]
-                                )
-                            )
-                        index = end + 1
-                    elif match == "echo":
-                        end = s.index("$$", index + 2)
-                        if end == -1:
-                            raise HamillException(f"Unclosed display in {s}")
-                        content = s[index + 2:end]
-                        nodes.append(GetVar(doc, content))
-                        index = end + 1
-                    elif match == "code":
-                        is_code_ok = Hamill.find(s, index + 2, "@@")
-                        if is_code_ok == -1:
-                            raise HamillException(
-                                "Unfinished inline code sequence: " + s
-                            )
-                        code_str = s[index + 2:is_code_ok]
-                        lang = None
-                        language = code_str.split(" ")[0]
-                        if language in LANGUAGES:
-                            lang = language
-                            code_str = code_str[len(language)+1:] # remove the language and one space
-                        nodes.append(Code(doc, Hamill.unescape_code(code_str), None, None, lang, True)) # unescape only @@ !
-                        index = is_code_ok + 1 # will inc by 1 at the end of the loop
-                    else:
-                        # match with text modes
-                        if not modes[match]:
-                            modes[match] = True
-                            text_modifier_stack.append([match, s])
-                            nodes.append(Start(doc, match))
-                        else:
-                            modes[match] = False
-                            last = text_modifier_stack.pop()
-                            last_mode = last[0]
-                            if last_mode != match:
-                                raise HamillException(f"Incoherent stacking of the modifier: finishing {match} but {last_mode} should be closed first in {last[1]}")
-                            nodes.append(Stop(doc, match))
-                        index += 1
-                # no match
+                        )
+                    index = end + 2
+                elif match == "echo":
+                    end = s.index("$$", index + 2)
+                    if end == -1:
+                        raise HamillException(f"Unclosed display in {s}")
+                    content = s[index + 2:end]
+                    nodes.append(GetVar(doc, content))
+                    index = end + 2
+                elif match == "code":
+                    is_code_ok = Hamill.find(s, index + 2, "@@")
+                    if is_code_ok == -1:
+                        raise HamillException(
+                            "Unfinished inline code sequence: " + s
+                        )
+                    code_str = s[index + 2:is_code_ok]
+                    lang = None
+                    language = code_str.split(" ")[0]
+                    if language in LANGUAGES:
+                        lang = language
+                        code_str = code_str[len(language)+1:] # remove the language and one space
+                    nodes.append(Code(doc, Hamill.unescape_code(code_str), None, None, lang, True)) # unescape only @@ !
+                    index = is_code_ok + 2
                 else:
-                    word += char
-            index += 1
+                    # match with text modes
+                    if not modes[match]:
+                        modes[match] = True
+                        text_modifier_stack.append([match, s])
+                        nodes.append(Start(doc, match))
+                    else:
+                        modes[match] = False
+                        last = text_modifier_stack.pop()
+                        last_mode = last[0]
+                        if last_mode != match:
+                            raise HamillException(f"Incoherent stacking of the modifier: finishing {match} but {last_mode} should be closed first in {last[1]}")
+                        nodes.append(Stop(doc, match))
+                    index += 2
         if len(word) > 0:
             nodes.append(Text(doc, word))
         if len(text_modifier_stack) > 0:
@@ -1559,6 +1833,27 @@ class Hamill:
             raise HamillException(f"Unclosed {last[0]} text mode in {last[1]}.")
         return nodes
 
+    # Remove the markers of alignment (= or >) and span (#c2# or #r2#) from the first node of a cell
+    @staticmethod
+    def parse_inner_cell(nodes):
+        res = {"align": None, "span": None, "span_value": None}
+        if len(nodes) == 0 or not isinstance(nodes[0], Node):
+            return res
+        first = nodes[0]
+        if len(first.content) > 0 and first.content[0] == "=":
+            first.content = first.content[1:]
+            res["align"] = "center"
+        elif len(first.content) > 0 and first.content[0] == ">":
+            first.content = first.content[1:]
+            res["align"] = "right"
+        if len(first.content) > 2 and first.content[0] == "#" and first.content[1] in ["c", "r"]:
+            end = first.content.find("#", 2)
+            if end != -1:
+                res["span"] = "colspan" if first.content[1] == "c" else "rowspan"
+                res["span_value"] = first.content[2:end]
+                first.content = first.content[end + 1:]
+        return res
+
     @staticmethod
     def parse_inner_picture(content):
         res = None
@@ -1667,6 +1962,7 @@ tests = [
     ["//ceci est emphase//", "<p><em>ceci est emphase</em></p>\n"],
     # Escaping
     ["\\**bonjour\\**", "<p>**bonjour**</p>\n"],
+    ["a \\## **b** \\!!c\\!! ''d''", "<p>a ## <b>b</b> !!c!! <i>d</i></p>\n"],
     [
         "@@code \\@@variable = '\\n' end@@",
         "<p><code>code @@variable = '\\n' end</code></p>\n",
@@ -1823,6 +2119,10 @@ tests = [
         "|abc|>def|",
         '<table>\n<tr><td>abc</td><td style="text-align: right">def</td></tr>\n</table>\n'
     ],
+    [
+        "|=#c2#abc|#r2#def|\n|>ghi|jkl|",
+        '<table>\n<tr><td style="text-align: center" colspan="2">abc</td><td rowspan="2">def</td></tr>\n<tr><td style="text-align: right">ghi</td><td>jkl</td></tr>\n</table>\n'
+    ],
     [
         "|abc|def\\|ghk|",
         "<table>\n<tr><td>abc</td><td>def|ghk</td></tr>\n</table>\n"
@@ -1944,6 +2244,10 @@ tests = [
         "!var DEFAULT_CODE=bnf\nYoupi j'aime bien les @@<règles>@@ !\n",
         '<p>Youpi j\'aime bien les <code><span class="bnf-keyword" title="token n°0 : keyword">&lt;règles&gt;</span></code> !</p>\n'
     ],
+    [
+        "!var DEFAULT_CODE=bnf\n@@<règles>@@ et @@<règles>@@\n",
+        '<p><code><span class="bnf-keyword" title="token n°0 : keyword">&lt;règles&gt;</span></code> et <code><span class="bnf-keyword" title="token n°0 : keyword">&lt;règles&gt;</span></code></p>\n'
+    ],
     # More tests
     [
         "* @@*@@ pour une liste non numérotée",
@@ -1953,6 +2257,15 @@ tests = [
     [
         "!var NEXT_CODE_CLASS=cls\n!var NEXT_CODE_ID=ids\n@@@\nhello\n@@@",
         '<pre id="ids" class="cls">\nhello\n</pre>\n'
+    ],
+    # Compact code: class only, adjacent tokens of the same type merged, blanks and newlines without span
+    [
+        "!var COMPACT_CODE=true\n@@@ruby\nif a == 5 then\n    puts('hello 5'))\nend\n@@@\n",
+        '<pre>\n\
+<span class="ruby-keyword">if</span> <span class="ruby-identifier">a</span> <span class="ruby-operator">==</span> <span class="ruby-integer">5</span> <span class="ruby-keyword">then</span>\n\
+    <span class="ruby-identifier">puts</span><span class="ruby-separator">(</span><span class="ruby-string">\'hello 5\'</span><span class="ruby-separator">))</span>\n\
+<span class="ruby-keyword">end</span>\n\
+</pre>\n'
     ]
 ]
 
@@ -2012,6 +2325,184 @@ def run_test(text, result, error = None):
             print(f"-- No error was expected, expected:\n{result}")
             return False
 
+# Scaling tests: the escape-aware functions must stay linear on very long lines
+
+def scaling_lines(size):
+    row = ("|cell \\| a " * (size // 11 + 1))[:size]
+    code = ("@@a\\@b@@ x " * (size // 11 + 1))[:size]
+    return row, code
+
+def find_all_code(code):
+    count = 0
+    index = code.find("@@")
+    while index != -1:
+        end = Hamill.find(code, index + 2, "@@")
+        if end == -1:
+            break
+        count += 1
+        index = code.find("@@", end + 2)
+    return count
+
+def run_scaling_tests(small = 256 * 1024, big = 1024 * 1024, margin = 2.5):
+    """The time on big lines must be at most margin times the linear extrapolation from small lines"""
+    print("\n========================================================================")
+    print("Starting scaling tests")
+    print("========================================================================")
+    functions = {
+        "escaped_split": lambda row, code: len(Hamill.escaped_split("|", row)),
+        "find": lambda row, code: find_all_code(code),
+        "unescape_code": lambda row, code: len(Hamill.unescape_code(code)),
+    }
+    nb_ok = 0
+    for name, function in functions.items():
+        times = []
+        for size in (small, big):
+            row, code = scaling_lines(size)
+            best = None
+            for _ in range(3):
+                start = time.perf_counter()
+                function(row, code)
+                duration = time.perf_counter() - start
+                best = duration if best is None else min(best, duration)
+            times.append(best)
+        limit = times[0] * big / small * margin
+        ok = times[1] <= limit
+        print(f"{'[SUCCESS]' if ok else '[FAILURE]'} {name} : {times[0]:.4f}s for {small // 1024} KB, {times[1]:.4f}s for {big // 1024} KB (limit {limit:.4f}s)")
+        if ok:
+            nb_ok += 1
+    print(f"\nScaling tests ok : {nb_ok} / {len(functions)}\n")
+
+# Cache tests: each function returns None if the cache behaves as expected, else the error
+
+def test_highlight_store():
+    import tempfile
+    with tempfile.TemporaryDirectory() as directory:
+        store = HighlightStore(directory, 1000)
+        if store.get("python", "a = 1", [], False) is not None or store.misses != 1:
+            return "a missing entry is not a miss"
+        store.set("python", "a = 1", [], False, "<b>a</b>")
+        if store.get("python", "a = 1", [], False) != "<b>a</b>" or store.hits != 1:
+            return "a saved entry is not a hit"
+        # A second write replaces the file by a rename and leaves no temporary file
+        store.set("python", "a = 1", [], False, "<b>b</b>")
+        if store.get("python", "a = 1", [], False) != "<b>b</b>" or len(store.get_entries('.tmp')) > 0:
+            return "an entry is not replaced atomically"
+        LEXERS["sample"] = weyland.Lexer(LANGUAGES["python"])
+        try:
+            path = store.get_path("sample", "a = 1", [], False)
+            LEXERS["sample"] = weyland.Lexer(LANGUAGES["lua"])
+            if store.get_path("sample", "a = 1", [], False) == path:
+                return "the definitions of the language of the lexer are not in the key"
+        finally:
+            del LEXERS["sample"]
+        from weyland import tables
+        lua = LANGUAGES["lua"]
+        changed = weyland.Language("lua", lua.sources, lua.wrong, lua.specials, {"string": [("\\[\\[", "\\]\\]")]})
+        if tables.definitions_hash(changed) == tables.definitions_hash(lua):
+            return "the blocks of the language are not in the key"
+        # Over max_size, the least recently used files are removed down to PRUNE_RATIO of max_size
+        store.clear()
+        for index in range(10):
+            store.set("python", f"x = {index}", [], False, "o" * 150)
+            os.utime(store.get_path("python", f"x = {index}", [], False), (index, index))
+        if store.get_size() > store.max_size:
+            return f"the size is {store.get_size()} for a maximum of {store.max_size}"
+        if store.get("python", "x = 0", [], False) is not None or store.get("python", "x = 9", [], False) is None:
+            return "the pruning has not removed the least recently used files"
+        store.prune()
+        if store.get_size() > store.max_size * HighlightStore.PRUNE_RATIO:
+            return f"the size is {store.get_size()} after a pruning"
+        # Only the temporary files not written for TEMP_AGE seconds are removed
+        orphan = os.path.join(directory, "ab", "orphan.1.tmp")
+        fresh = os.path.join(directory, "ab", "fresh.2.tmp")
+        os.makedirs(os.path.dirname(orphan), exist_ok=True)
+        for temp in (orphan, fresh):
+            with open(temp, 'w') as f:
+                f.write("partial")
+        os.utime(orphan, (0, 0))
+        store.prune()
+        if os.path.exists(orphan) or not os.path.exists(fresh):
+            return "the orphaned temporary files are not pruned"
+    return None
+
+def test_highlight_cache():
+    cache = HighlightCache(2)
+    first = cache.highlight("python", "a = 1", [])
+    if cache.highlight("python", "a = 1", []) is not first or cache.stats()["hits"] != 1 or cache.stats()["misses"] != 1:
+        return f"a second highlight is not a hit: {cache.stats()}"
+    if cache.highlight("python", "a = 1", ["blank"]) == first or cache.stats()["misses"] != 2:
+        return "the raws are not in the key"
+    # Using "a = 1" with [] again leaves the entry with ["blank"] the least recently used: a third entry evicts it
+    cache.highlight("python", "a = 1", [])
+    cache.highlight("python", "b = 2", [])
+    python = LEXERS["python"]
+    if cache.stats()["entries"] != 2 or (python, "a = 1", ("blank",), False) in cache.entries or (python, "a = 1", (), False) not in cache.entries:
+        return f"the least recently used entry is not evicted at the size: {list(cache.entries)}"
+    # A lexer set in LEXERS replaces the HTML of the previous one
+    LEXERS["sample"] = weyland.Lexer(LANGUAGES["python"])
+    try:
+        before = cache.highlight("sample", "x = None", [])
+        LEXERS["sample"] = weyland.Lexer(LANGUAGES["lua"])
+        after = cache.highlight("sample", "x = None", [])
+        if after == before or after != LEXERS["sample"].to_html("x = None", None, []):
+            return "the HTML of a replaced lexer is still used"
+    finally:
+        del LEXERS["sample"]
+    cache.set_size(0)
+    cache.clear()
+    cache.highlight("python", "a = 1", [])
+    cache.highlight("python", "a = 1", [])
+    if cache.stats()["hits"] != 0 or cache.stats()["misses"] != 2 or cache.stats()["entries"] != 0:
+        return f"a size of 0 does not disable the cache: {cache.stats()}"
+    return None
+
+def test_inline_cache():
+    INLINE_CACHE.clear()
+    # A string with an id is never kept: its id is registered again and a duplicate is still an error
+    try:
+        Hamill.process("a {{#x rouge}} b\n\na {{#x rouge}} b")
+        return "a duplicate id is not detected"
+    except HamillException as e:
+        if "same id" not in str(e):
+            return f"unexpected error: {e}"
+    if INLINE_CACHE.hits != 0 or INLINE_CACHE.misses != 2 or "a {{#x rouge}} b" in INLINE_CACHE.entries:
+        return f"a string with an id is kept: {INLINE_CACHE.stats()}"
+    # A hit returns new nodes, display of the links included, bound to the new document
+    first = Document()
+    second = Document()
+    text = "some **bold** [[text->https://xitog.github.io/dgx]]"
+    nodes = Hamill.parse_inner_string(first, text)
+    copies = Hamill.parse_inner_string(second, text)
+    if INLINE_CACHE.hits != 1:
+        return f"the second parse is not a hit: {INLINE_CACHE.stats()}"
+    if any(node is copy or copy.document is not second for node, copy in zip(nodes, copies)) \
+       or nodes[-1].display[0] is copies[-1].display[0] or copies[-1].display[0].document is not second:
+        return "a hit is not a copy bound to the new document"
+    # The markers of a table cell are removed from the copy, never from the cached entry
+    outputs = [Hamill.process("|=#c2#abc|def|\n").to_html() for _ in range(3)]
+    if outputs[0] != outputs[1] or outputs[1] != outputs[2] or 'style="text-align: center" colspan="2">abc<' not in outputs[2]:
+        return f"the rendering of a table changes with the cache: {outputs}"
+    if INLINE_CACHE.entries["=#c2#abc"][0].content != "=#c2#abc":
+        return "a table cell has altered the cached entry"
+    return None
+
+def run_cache_tests():
+    print("\n========================================================================")
+    print("Starting cache tests")
+    print("========================================================================")
+    functions = {
+        "HighlightCache": test_highlight_cache,
+        "HighlightStore": test_highlight_store,
+        "InlineCache": test_inline_cache,
+    }
+    nb_ok = 0
+    for name, function in functions.items():
+        error = function()
+        print(f"{'[SUCCESS]' if error is None else '[FAILURE]'} {name}{'' if error is None else ' : ' + error}")
+        if error is None:
+            nb_ok += 1
+    print(f"\nCache tests ok : {nb_ok} / {len(functions)}\n")
+
 #------------------------------------------------------------------------------
 # Main
 #------------------------------------------------------------------------------
@@ -2026,6 +2517,8 @@ message = "---\n"
 message += "> Use hamill.mjs --process (or -p) <input config filepath> to convert the HML file to HTML\n"
 message += "  The file must be an object {} with a key named targets with an array value of pairs :\n"
 message += '            ["inputFile", "outputDir"]\n'
+message += '  An optional key highlight_cache gives a directory to keep the highlighted code between runs\n'
+message += '  (at most highlight_cache_size bytes). The environment variable HAMILL_CACHE_DIR does the same.\n'
 message += f"> Use hamill.mjs --tests (or -t) to launch all the tests ({len(tests)}).\n"
 message += "> Use hamill.mjs --eval (or -e) to run a read-eval-print-loop from hml to html\n"
 message += "> Use hamill.mjs --help (or -h) to display this message"
@@ -2059,6 +2552,8 @@ elif len(sys.argv) == 3:
         f = open(filepath, 'r', encoding='utf-8')
         config = json.load(f)
         f.close()
+        if "highlight_cache" in config:
+            HIGHLIGHT_CACHE.set_store(HighlightStore(config["highlight_cache"], config.get("highlight_cache_size", HighlightStore.MAX_SIZE)))
         for target in config["targets"]:
             if "do" in target and "source" in target and "destination" in target:
                 if target["do"]:
@@ -2076,6 +2571,8 @@ elif len(sys.argv) == 3:
             else:
                 print('Malformed configuration file. Aborting.')
                 exit()
+        inline = INLINE_CACHE.stats()
+        print(f"Inline cache: {inline['hits']} hits, {inline['misses']} misses ({inline['hit_rate']:.1%}), {inline['with_ids']} with ids")
     else:
         print("Unrecognized options. Type --help for help.")
 else:
@@ -2083,3 +2580,5 @@ else:
 
 if do_test:
     run_all_tests(True) #, 5)
+    run_scaling_tests()
+    run_cache_tests()
@@ -30,24 +30,23 @@
 __version__ = "0.2.7"
 
 # Imports
-import logging
 from weyland.lexer import *
 from weyland.languages import RECOGNIZED_LANGUAGES, LANGUAGES, PATTERNS, Language
 
-logging.basicConfig(format='%(levelname)s %(asctime)s %(message)s')
-logging.getLogger().setLevel(logging.DEBUG)
+# Lexers and their languages are only compiled on first lookup
+LEXERS = LexerRegistry({
+    'ash': ['blank'],
+    'bnf': ['blank'],
+    #'bnf-mini': ['blank'],
+    #'fr': ['blank'],
+    'game': ['blank', 'newline'],
+    'hamill': ['blank'],
+    'json': ['blank', 'newline'],
+    #'line': None,
+    'lua': ['blank'],
+    'python': None,
+    'ruby': None,
+    'text': ['blank'],
+})
 
-LEXERS = {
-    'ash': Lexer(LANGUAGES['ash'], ['blank']),
-    'bnf': Lexer(LANGUAGES['bnf'], ['blank']),
-    #'bnf-mini': Lexer(LANGUAGES['bnf-mini'], ['blank']),
-    #'fr': Lexer(LANGUAGES['fr'], ['blank']),
-    'game': Lexer(LANGUAGES['game'], ['blank', 'newline']),
-    'hamill': Lexer(LANGUAGES['hamill'], ['blank']),
-    'json': Lexer(LANGUAGES['json'], ['blank', 'newline']),
-    #'line': Lexer(LANGUAGES['line']),
-    'lua': Lexer(LANGUAGES['lua'], ['blank']),
-    'python': Lexer(LANGUAGES['python']),
-    'ruby': Lexer(LANGUAGES['ruby']),
-    'text': Lexer(LANGUAGES['text'], ['blank']),
-}
+from weyland.batch import lex_many, highlight_many
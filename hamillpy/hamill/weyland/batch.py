@@ -0,0 +1,130 @@
+# -----------------------------------------------------------
+# MIT Licence (Expat License Wording)
+# -----------------------------------------------------------
+# Copyright © 2020, Damien Gouteux
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# For more information about my projects see:
+# https://xitog.github.io/dgx (in French)
+
+"""Batch: lexes or highlights many independent texts on a pool of processes
+
+The workers do not look up the lexers in their own LEXERS: a job sends the definitions of the lexer
+registered in this process (see get_recipe), so a lexer set in LEXERS at runtime is used by the workers,
+whatever the start method of the processes (fork or spawn).
+"""
+
+#-------------------------------------------------------------------------------
+# Imports
+#-------------------------------------------------------------------------------
+
+import hashlib
+import os
+
+import weyland
+from weyland.languages import Language
+from weyland.lexer import Lexer
+
+#-------------------------------------------------------------------------------
+# Globals and constants
+#-------------------------------------------------------------------------------
+
+# Under this number of characters in total, starting the processes costs more than it saves
+SERIAL_THRESHOLD = 256 * 1024
+
+# Number of chunks given to each worker when no chunk size is set
+CHUNKS_BY_WORKER = 4
+
+# Lexers built by a worker from the recipes of the jobs, by key
+BUILT = {}
+
+#-------------------------------------------------------------------------------
+# Functions
+#-------------------------------------------------------------------------------
+
+def get_workers(workers=None):
+    if workers is None:
+        return os.cpu_count() or 1
+    return max(1, workers)
+
+def is_serial(items, workers, threshold):
+    return workers == 1 or len(items) < 2 or sum(len(text) for _, text in items) < threshold
+
+def get_recipe(lang):
+    """Return a key and the definitions needed to build again the lexer of LEXERS[lang] in a worker"""
+    lexer = weyland.LEXERS[lang]
+    language = lexer.get_language()
+    recipe = (language.name, language.sources, language.wrong, language.specials, language.block_sources, lexer.discards, lexer.engine)
+    return hashlib.sha256(repr(recipe).encode('utf8')).hexdigest(), recipe
+
+def get_lexer(lexer):
+    """Return the lexer of a job: a name in LEXERS when run in this process, a key and a recipe in a worker"""
+    if isinstance(lexer, str):
+        return weyland.LEXERS[lexer]
+    key, recipe = lexer
+    if key not in BUILT:
+        name, sources, wrong, specials, blocks, discards, engine = recipe
+        BUILT[key] = Lexer(Language(name, sources, wrong, specials, blocks), discards, engine)
+    return BUILT[key]
+
+def get_jobs(items, serial, *parameters):
+    """Return the jobs of items. For the workers, the same recipe object is shared by the jobs of a language:
+       it is pickled once by chunk."""
+    recipes = {} if serial else {lang: get_recipe(lang) for lang, _ in items}
+    return [(lang if serial else recipes[lang], text) + parameters for lang, text in items]
+
+# The job functions are at module level so the workers can unpickle them
+
+def lex_job(job):
+    lexer, text, discards, engine = job
+    return get_lexer(lexer).lex(text, discards, False, engine)
+
+def highlight_job(job):
+    lexer, text, raws, compact = job
+    return get_lexer(lexer).to_html(text, None, raws, compact)
+
+def run(function, jobs, workers=None, chunksize=None, executor=None, serial=False):
+    """Return the results of function on jobs, in the order of jobs"""
+    if serial:
+        return [function(job) for job in jobs]
+    workers = get_workers(workers)
+    if chunksize is None:
+        chunksize = max(1, len(jobs) // (workers * CHUNKS_BY_WORKER))
+    if executor is not None:
+        return list(executor.map(function, jobs, chunksize=chunksize))
+    # Imported here: concurrent.futures would double the import time of weyland
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(function, jobs, chunksize=chunksize))
+
+def lex_many(items, discards=None, engine=None, workers=None, chunksize=None, executor=None, threshold=SERIAL_THRESHOLD):
+    """Lex each (language, text) of items with LEXERS. Return the lists of tokens in the order of items.
+       workers is the number of processes, by default the number of CPUs. An executor can be given to reuse a pool.
+       Small batches (fewer characters than threshold) and workers=1 are lexed in this process."""
+    items = list(items)
+    serial = executor is None and is_serial(items, get_workers(workers), threshold)
+    return run(lex_job, get_jobs(items, serial, discards, engine), workers, chunksize, executor, serial)
+
+def highlight_many(items, raws=None, workers=None, chunksize=None, executor=None, threshold=SERIAL_THRESHOLD, compact=False):
+    """Highlight each (language, text) of items with LEXERS. Return the HTML strings in the order of items.
+       The parameters are the same as for lex_many, compact is the one of Lexer.to_html."""
+    items = list(items)
+    serial = executor is None and is_serial(items, get_workers(workers), threshold)
+    return run(highlight_job, get_jobs(items, serial, raws, compact), workers, chunksize, executor, serial)
@@ -0,0 +1,283 @@
+# -----------------------------------------------------------
+# MIT Licence (Expat License Wording)
+# -----------------------------------------------------------
+# Copyright © 2020, Damien Gouteux
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# For more information about my projects see:
+# https://xitog.github.io/dgx (in French)
+
+"""Bench: measures the throughput of the lexers on generated texts of increasing size
+
+Usage: python -m weyland.bench [--engine master|prefix|fast] [--languages lua,json] [--max-size 1M]
+                               [--output results.json] [--baseline baseline.json] [--check] [--dispatch]
+"""
+
+#-------------------------------------------------------------------------------
+# Imports
+#-------------------------------------------------------------------------------
+
+import argparse
+import json
+import math
+import platform
+import sys
+import time
+
+from weyland import __version__, LANGUAGES, LEXERS
+from weyland.lexer import Lexer, LexingException, dispatch_report
+from weyland.scanners import SCANNERS
+
+#-------------------------------------------------------------------------------
+# Globals and constants
+#-------------------------------------------------------------------------------
+
+KB = 1024
+MB = 1024 * KB
+
+SIZES = [1 * KB, 10 * KB, 100 * KB, 1 * MB, 10 * MB]
+
+# Sizes under this one are dominated by fixed costs and are not used for the scaling
+SCALING_MIN_SIZE = 10 * KB
+
+# Above 1 + this value, the exponent of time = a * size ** exponent is reported as non-linear
+SCALING_TOLERANCE = 0.15
+
+# A throughput lower than the baseline by more than this fraction is a regression
+REGRESSION_TOLERANCE = 0.25
+
+# Each text is the sample of its language repeated until the wanted size.
+# A sample must end with a newline and lex the same way alone and repeated.
+SAMPLES = {
+    'ash': 'var a = 5\nconst b = "text with \\"quotes\\""\n'
+           'if a >= 2 and b != nil then\n    writeln(a ** 2 + b.length)\nend -- comment\n'
+           'fun square(x)\n    return x * x\nend\nfor i in 1..10 do a += square(i) end\n',
+    'bnf': '<expression> ::= <term> | <expression> "plus" <term>\n'
+           '<term> ::= <factor> { "times" <factor> }\n'
+           '# comment on a rule\n'
+           '<factor> ::= "open" <expression> "close" | <nombre> ... A [ B ]\n',
+    'game': 'Far Cry, 2004; Half-Life 2, 2004\nThe Witcher 3: Wild Hunt, 2015\nStarCraft II, 2010\n',
+    'hamill': '## Title of a section\n\nSome **bold** and \'\'italic\'\' text with a {{markup}}.\n'
+              '* first item\n* second item\n\n|-----|\n| cell | cell |\n'
+              '!var NAME=value\n!rem a comment\nhttps://xitog.github.io/dgx here\n\n',
+    'json': '{"name": "value", "number": 42, "float": 3.14, "list": [1, 2, 3],\n'
+            ' "object": {"key": true, "other": false, "none": null}},\n',
+    'lua': 'local t = { ["k1"] = 5, ["k2"] = "v", [4] = 6 } -- Définition\n'
+           'print(t["k1"]) -- Accès\nfunction f(a, b)\n    if a <= b and a ~= 0 then return a .. b end\nend\n'
+           'for i, v in ipairs(t) do x = x + v * 2.5 end\n',
+    'python': 'def function(a, b=5):\n    """Docstring"""\n    if a <= b and not a is None:\n'
+              '        return [a ** 2, b // 3, 1.5] # comment\n    return {"key": \'value\'}\n\n'
+              'class Sample:\n    pass\n',
+    'ruby': 'def square(x)\n  return x ** 2\nend\n# comment\n'
+            'if a >= 0b101 and b != 0xFF then\n  writeln("text", 3.14)\nend\n'
+            'module Mod\n  class Klass\n  end\nend\n',
+    'text': 'Lorem ipsum dolor sit amet, consectetur adipiscing elit,\tsed do eiusmod tempor.\n'
+            'Ut enim ad minim veniam, quis nostrud exercitation ullamco laboris.\n',
+}
+
+#-------------------------------------------------------------------------------
+# Functions
+#-------------------------------------------------------------------------------
+
+def get_lexer(name):
+    if name in LEXERS:
+        return LEXERS[name]
+    return Lexer(LANGUAGES[name])
+
+def get_engines(name):
+    return Lexer.ENGINES + [Lexer.FAST] if name in SCANNERS else Lexer.ENGINES
+
+def generate(name, size):
+    """Return a text of the language of at least size characters, made of whole samples"""
+    sample = SAMPLES[name]
+    return sample * max(1, math.ceil(size / len(sample)))
+
+def count_tokens(lexer, text, engine):
+    count = 0
+    for _ in lexer.scan(text, None, False, engine):
+        count += 1
+    return count
+
+def measure(lexer, text, engine, min_time=0.2, max_repeat=5):
+    """Return the number of tokens and the best time of several runs. Long texts are lexed once."""
+    best = None
+    total = 0
+    repeat = 0
+    while repeat < max_repeat and (repeat == 0 or total < min_time):
+        start = time.perf_counter()
+        tokens = count_tokens(lexer, text, engine)
+        elapsed = time.perf_counter() - start
+        total += elapsed
+        best = elapsed if best is None else min(best, elapsed)
+        repeat += 1
+    return tokens, best
+
+def scaling_exponent(points):
+    """Return the exponent of a least squares fit of seconds = a * size ** exponent, None without enough points"""
+    points = [(math.log(size), math.log(seconds)) for size, seconds in points if size >= SCALING_MIN_SIZE and seconds > 0]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    if variance == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+
+def bench_language(name, sizes=SIZES, engine='master', verbose=False):
+    lexer = get_lexer(name)
+    runs = []
+    for size in sizes:
+        text = generate(name, size)
+        tokens, seconds = measure(lexer, text, engine)
+        length = len(text.encode('utf8'))
+        run = {
+            'size': length,
+            'tokens': tokens,
+            'seconds': seconds,
+            'tokens_per_s': tokens / seconds if seconds > 0 else None,
+            'mb_per_s': length / MB / seconds if seconds > 0 else None,
+        }
+        runs.append(run)
+        if verbose:
+            print(f"{name:8s} {length:10d} B {tokens:9d} tokens {seconds:9.4f} s "
+                  f"{run['tokens_per_s']:12.0f} tokens/s {run['mb_per_s']:8.3f} MB/s")
+    exponent = scaling_exponent([(run['size'], run['seconds']) for run in runs])
+    return {
+        'runs': runs,
+        'exponent': exponent,
+        'linear': exponent is None or exponent <= 1 + SCALING_TOLERANCE,
+    }
+
+def bench(languages=None, sizes=SIZES, engine='master', verbose=False):
+    """Lex a generated text of each size for each language. Return a dict ready to be written as JSON."""
+    languages = list(SAMPLES) if languages is None else languages
+    results = {
+        'weyland': __version__,
+        'python': platform.python_version(),
+        'implementation': sys.implementation.name,
+        'engine': engine,
+        'sizes': list(sizes),
+        'languages': {},
+    }
+    for name in languages:
+        results['languages'][name] = bench_language(name, sizes, engine, verbose)
+    return results
+
+def non_linear(results):
+    """Return the languages whose time grows faster than the size of the text"""
+    return [name for name, result in results['languages'].items() if not result['linear']]
+
+def compare(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    """Return the list of the differences between results and baseline: fewer MB/s or another number of tokens"""
+    problems = []
+    for name, result in results['languages'].items():
+        if name not in baseline['languages']:
+            continue
+        previous = {run['size']: run for run in baseline['languages'][name]['runs']}
+        for run in result['runs']:
+            if run['size'] not in previous:
+                continue
+            before = previous[run['size']]
+            if run['tokens'] != before['tokens']:
+                problems.append(f"{name} {run['size']} B: {run['tokens']} tokens instead of {before['tokens']}")
+            if before['mb_per_s'] and run['mb_per_s'] and run['mb_per_s'] < before['mb_per_s'] * (1 - tolerance):
+                problems.append(f"{name} {run['size']} B: {run['mb_per_s']:.3f} MB/s instead of {before['mb_per_s']:.3f} MB/s")
+    return problems
+
+def check(languages=None):
+    """Check that each sample lexes alone and repeated, with the same tokens for all the engines"""
+    languages = list(SAMPLES) if languages is None else languages
+    for name in languages:
+        lexer = get_lexer(name)
+        text = generate(name, 4 * len(SAMPLES[name]))
+        results = {}
+        for engine in get_engines(name):
+            results[engine] = [(tok.get_type(), tok.get_start()) for tok in lexer.lex(text, None, False, engine)]
+            single = lexer.lex(SAMPLES[name], None, False, engine)
+            if len(results[engine]) != 4 * len(single):
+                raise LexingException(f"Sample of {name} does not lex the same way repeated with engine {engine}")
+        if any(results[engine] != results[Lexer.ENGINES[0]] for engine in results):
+            raise LexingException(f"Sample of {name} does not lex the same way with all the engines")
+        print(f"[SUCCESS] Sample {name} : {len(results[Lexer.ENGINES[0]])} tokens")
+
+def dispatch(languages=None, engine='prefix'):
+    """Return for each language the regex tried and avoided by the first character dispatch on its sample"""
+    languages = list(SAMPLES) if languages is None else languages
+    return {name: dispatch_report(get_lexer(name), [SAMPLES[name]], engine) for name in languages}
+
+def parse_size(value):
+    units = {'K': KB, 'M': MB}
+    value = value.strip().upper().rstrip('B')
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+#-------------------------------------------------------------------------------
+# Main
+#-------------------------------------------------------------------------------
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='python -m weyland.bench', description='Throughput of the weyland lexers')
+    parser.add_argument('--engine', default='master', choices=Lexer.ENGINES + [Lexer.FAST])
+    parser.add_argument('--languages', default=None, help='comma separated names, all the languages by default '
+                                                          '(the ones with a fast scanner for --engine fast)')
+    parser.add_argument('--max-size', default='10M', help='biggest text, for example 100K or 10M')
+    parser.add_argument('--output', default=None, help='JSON file for the results')
+    parser.add_argument('--baseline', default=None, help='JSON file of previous results to compare with')
+    parser.add_argument('--check', action='store_true', help='only check the samples')
+    parser.add_argument('--dispatch', action='store_true', help='only report the regex avoided by the first character dispatch')
+    options = parser.parse_args(args)
+    languages = None if options.languages is None else options.languages.split(',')
+    if languages is None and options.engine == Lexer.FAST:
+        languages = list(SCANNERS)
+    for name in languages or []:
+        if name not in SAMPLES:
+            parser.error(f"unknown language {name}, choose in {', '.join(SAMPLES)}")
+        if options.engine == Lexer.FAST and name not in SCANNERS:
+            parser.error(f"no fast scanner for {name}, choose in {', '.join(SCANNERS)}")
+    if options.check:
+        check(languages)
+        return 0
+    if options.dispatch:
+        if options.engine == Lexer.FAST:
+            parser.error("the fast scanners have no dispatch, choose in " + ', '.join(Lexer.ENGINES))
+        for name, report in dispatch(languages, options.engine).items():
+            print(f"{name:8s} {report['tried']:7d} regex tried {report['avoided']:7d} avoided ({report['ratio']:.1%})")
+        return 0
+    max_size = parse_size(options.max_size)
+    results = bench(languages, [size for size in SIZES if size <= max_size], options.engine, True)
+    status = 0
+    for name in non_linear(results):
+        print(f"[NON LINEAR] {name}: exponent {results['languages'][name]['exponent']:.2f}")
+        status = 1
+    if options.output is not None:
+        with open(options.output, 'w', encoding='utf8') as f:
+            json.dump(results, f, indent=2)
+    if options.baseline is not None:
+        with open(options.baseline, 'r', encoding='utf8') as f:
+            baseline = json.load(f)
+        for problem in compare(results, baseline):
+            print(f"[REGRESSION] {problem}")
+            status = 1
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main())
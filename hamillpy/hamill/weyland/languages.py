@@ -32,6 +32,147 @@
 
 import re
 
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:
+    import sre_parse, sre_constants
+
+#-------------------------------------------------------------------------------
+# Functions
+#-------------------------------------------------------------------------------
+
+def unanchor(pattern):
+    """Remove the ^ and $ put around a regex to get a pattern usable at any position of a text"""
+    if pattern.startswith('^'):
+        pattern = pattern[1:]
+    if pattern.endswith('$'):
+        # Count the backslashes before the final $ to leave \$ untouched
+        slashes = len(pattern) - 1 - len(pattern[:-1].rstrip('\\'))
+        if slashes % 2 == 0:
+            pattern = pattern[:-1]
+    return pattern
+
+def lookahead(index, scan):
+    """Return the part of a dispatch master pattern for the variant number index"""
+    source = scan.pattern
+    if scan.flags & re.M:
+        source = '(?m:' + source + ')'
+    return f'(?=(?P<v{index}>{source}))?'
+
+def first_chars(pattern):
+    """Return the classes of the characters a non empty match of pattern can start with, or None for any character.
+
+    A class is a pair (negate, items) with items a list of ('LITERAL', code), ('RANGE', (low, high))
+    or ('CATEGORY', name). Lookaheads are ignored, so the result can only be too large, never too small.
+    """
+    if pattern.flags & re.I:
+        return None
+    classes, _ = _first_of_sequence(sre_parse.parse(pattern.pattern, pattern.flags))
+    return classes
+
+def _first_of_sequence(items):
+    classes = []
+    for op, av in items:
+        first, nullable = _first_of_item(op, av)
+        if first is None:
+            return None, False
+        classes += first
+        if not nullable:
+            return classes, False
+    return classes, True
+
+def _first_of_item(op, av):
+    if op == sre_constants.LITERAL:
+        return [(False, [('LITERAL', av)])], False
+    elif op == sre_constants.NOT_LITERAL:
+        return [(True, [('LITERAL', av)])], False
+    elif op == sre_constants.IN:
+        negate = False
+        items = []
+        for item_op, item_av in av:
+            if item_op == sre_constants.NEGATE:
+                negate = True
+            elif item_op == sre_constants.LITERAL:
+                items.append(('LITERAL', item_av))
+            elif item_op == sre_constants.RANGE:
+                items.append(('RANGE', tuple(item_av)))
+            elif item_op == sre_constants.CATEGORY and str(item_av) in CATEGORIES:
+                items.append(('CATEGORY', str(item_av)))
+            else:
+                return None, False
+        return [(negate, items)], False
+    elif op == sre_constants.SUBPATTERN:
+        if av[1] & re.I:
+            return None, False
+        return _first_of_sequence(av[-1])
+    elif op == sre_constants.BRANCH:
+        classes = []
+        nullable = False
+        for branch in av[1]:
+            first, branch_nullable = _first_of_sequence(branch)
+            if first is None:
+                return None, False
+            classes += first
+            nullable = nullable or branch_nullable
+        return classes, nullable
+    elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+        first, nullable = _first_of_sequence(av[2])
+        return first, nullable or av[0] == 0
+    elif op in (sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+        # Zero width
+        return [], True
+    return None, False
+
+def literal(pattern):
+    """Return the text matched by pattern if it is made only of literal characters, None otherwise"""
+    if pattern.flags & re.I:
+        return None
+    items = sre_parse.parse(pattern.pattern, pattern.flags)
+    if len(items) == 0 or any(op != sre_constants.LITERAL for op, _ in items):
+        return None
+    return ''.join(chr(code) for _, code in items)
+
+def trie_pattern(words):
+    """Return a regex matching the longest of words at a position, built as a trie: in(?:t)? for in and int"""
+    root = {}
+    for word in words:
+        node = root
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+    return _trie_node(root)
+
+def _trie_node(node):
+    branches = [re.escape(char) + _trie_node(child) for char, child in sorted(node.items()) if char != '']
+    if len(branches) == 0:
+        return ''
+    pattern = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+    if '' in node:
+        # The end of a word is tried last so the longest word wins
+        pattern = '(?:' + pattern + ')?'
+    return pattern
+
+def expand_exit(pattern, enter):
+    """Replace \\1 to \\9 in the exit pattern of a block by the escaped groups of the match of its enter pattern"""
+    return re.sub('\\\\([1-9])', lambda ref: re.escape(enter.group(int(ref.group(1))) or ''), pattern)
+
+def can_start(classes, char):
+    """Return True if char is in one of the classes returned by first_chars"""
+    if classes is None:
+        return True
+    code = ord(char)
+    for negate, items in classes:
+        found = False
+        for kind, value in items:
+            if (kind == 'LITERAL' and code == value) or \
+                (kind == 'RANGE' and value[0] <= code <= value[1]) or \
+                (kind == 'CATEGORY' and CATEGORIES[value].fullmatch(char) is not None):
+                found = True
+                break
+        if found != negate:
+            return True
+    return False
+
 #-------------------------------------------------------------------------------
 # Class
 #-------------------------------------------------------------------------------
@@ -41,30 +182,95 @@ class LanguageException(Exception):
 
 class Language:
 
-    def __init__(self, name, definitions, wrong=None, specials=None):
+    def __init__(self, name, definitions, wrong=None, specials=None, blocks=None):
         wrong = [] if wrong is None else wrong
         specials = {} if specials is None else specials
+        blocks = {} if blocks is None else blocks
         self.name = name
         if not isinstance(definitions, dict):
             raise LanguageException("Tokens should be an object of {type: [regex]} and it is a " + type(definitions))
-        self.definitions = definitions
         for typ, variants in definitions.items():
             if variants is None:
                 raise LanguageException(f"No variants for {typ} in language {name}")
+        for typ, delimiters in blocks.items():
+            for delimiter in delimiters:
+                if not isinstance(delimiter, tuple) or len(delimiter) not in (2, 3):
+                    raise LanguageException(f"Blocks of {typ} in language {name} should be (enter, exit) or (enter, exit, unterminated type)")
+        # The regex are compiled on first use, see compile()
+        self.sources = definitions
+        self.definitions = None
+        self.specials = specials
+        self.wrong = wrong
+        self.variants = None
+        self.firsts = None # for each variant, the classes of its possible first characters
+        self.literals = None # for each variant, its text if it is a pure literal, else None
+        self.literal_variants = None # text of a literal => indexes of the variants equal to it
+        self.dispatch = {} # first character => (indexes of the variants that can start with it, indexes of the regex ones)
+        self.masters = {} # indexes of variants => master pattern restricted to them
+        # Blocks (block comments, long strings, heredocs) are scanned from their enter pattern to their exit pattern
+        self.block_sources = blocks
+        self.blocks = None # (type, enter, exit, type if unterminated or None), exit is a string if it refers to groups of enter
+        self.block_firsts = None
+        self.block_dispatch = {} # first character => indexes of the blocks that can start with it
+
+    def is_compiled(self):
+        return self.definitions is not None
+
+    def compile(self):
+        """Compile the language, from the tables saved on disk if they exist"""
+        if self.definitions is not None:
+            return
+        from weyland import tables
+        if not tables.load(self):
+            self.build()
+            tables.save(self)
+        self.build_blocks()
+
+    def build(self):
+        """Compile the language from its source definitions"""
         # In order to match the entire string we put ^ and $ at the start of each regex
-        for variants in definitions.values():
-            for index, pattern in enumerate(variants):
+        definitions = {}
+        for typ, variants in self.sources.items():
+            definitions[typ] = []
+            for pattern in variants:
                 if not isinstance(pattern, re.Pattern):
                     if pattern[0] != '^':
                         pattern = '^' + pattern
                     if pattern[-1] != '$':
                         pattern += '$'
                     if '[\\s\\S]' in pattern:
-                        variants[index] = re.compile(pattern, re.M)
+                        pattern = re.compile(pattern, re.M)
                     else:
-                        variants[index] = re.compile(pattern)
-        self.specials = specials
-        self.wrong = wrong
+                        pattern = re.compile(pattern)
+                definitions[typ].append(pattern)
+        # Each variant has an unanchored scan pattern, used in the dispatch masters (see get_dispatch_master)
+        self.variants = []
+        for typ, variants in definitions.items():
+            for elem in variants:
+                self.variants.append((typ, elem, re.compile(unanchor(elem.pattern), elem.flags)))
+        self.firsts = [first_chars(scan) for _, _, scan in self.variants]
+        self.literals = [literal(scan) for _, _, scan in self.variants]
+        self.index_literals()
+        self.definitions = definitions
+
+    def build_blocks(self):
+        """Compile the enter and exit patterns of the blocks. They are few and not saved in the tables."""
+        self.blocks = []
+        for typ, delimiters in self.block_sources.items():
+            for delimiter in delimiters:
+                enter = re.compile(delimiter[0], re.M)
+                exit = delimiter[1]
+                if re.search('\\\\[1-9]', exit) is None:
+                    exit = re.compile(exit, re.M)
+                self.blocks.append((typ, enter, exit, delimiter[2] if len(delimiter) == 3 else None))
+        self.block_firsts = [first_chars(enter) for _, enter, _, _ in self.blocks]
+
+    def index_literals(self):
+        """Group the literal variants by text. They are checked with a dictionary probe instead of a regex."""
+        self.literal_variants = {}
+        for index, text in enumerate(self.literals):
+            if text is not None:
+                self.literal_variants[text] = self.literal_variants.get(text, ()) + (index,)
 
     def is_wrong(self, typ):
         return typ in self.wrong
@@ -73,15 +279,128 @@ class Language:
         return self.name
 
     def get_type_definitions(self):
+        self.compile()
         return self.definitions.items()
 
+    def get_variants(self):
+        self.compile()
+        return self.variants
+
+    def get_dispatch(self, char):
+        """Return the indexes of the variants that can start with char and the indexes of the regex ones among them"""
+        if char not in self.dispatch:
+            self.compile()
+            candidates = tuple(index for index, classes in enumerate(self.firsts) if can_start(classes, char))
+            regexes = tuple(index for index in candidates if self.literals[index] is None)
+            self.dispatch[char] = (candidates, regexes)
+        return self.dispatch[char]
+
+    def get_literal_variants(self):
+        self.compile()
+        return self.literal_variants
+
+    def get_literal(self, word):
+        """Return the indexes of the literal variants equal to word"""
+        return self.literal_variants.get(word, ())
+
+    def has_blocks(self):
+        return len(self.block_sources) > 0
+
+    def find_block(self, text, start):
+        """Return the type and the end of the block starting at start in text, None if no block starts there.
+           The block ends after the first match of its exit pattern. Without one, the block goes to the end of text
+           only if it has a type for this case (like intermediate_comment), else None is returned and the text
+           is lexed as usual."""
+        char = text[start]
+        if char not in self.block_dispatch:
+            self.compile()
+            self.block_dispatch[char] = tuple(index for index, classes in enumerate(self.block_firsts) if can_start(classes, char))
+        for index in self.block_dispatch[char]:
+            typ, enter, exit, unterminated = self.blocks[index]
+            opening = enter.match(text, start)
+            if opening is None or opening.end() == start:
+                continue
+            if isinstance(exit, str):
+                exit = re.compile(expand_exit(exit, opening), re.M)
+            closing = exit.search(text, opening.end())
+            if closing is None:
+                if unterminated is None:
+                    continue
+                return unterminated, len(text)
+            return typ, closing.end()
+        return None
+
+    def find_open_block(self, text, end):
+        """Return the start of the first enter pattern before end in text without an exit pattern before end,
+           None if there is none. An edit at end can close this block or move its end.
+           The search ignores the tokens, so it can return a start where no block starts, never miss one."""
+        self.compile()
+        first = None
+        for _, enter, exit, _ in self.blocks:
+            if isinstance(exit, str):
+                # The exit depends on the enter match: each one is checked
+                for opening in enter.finditer(text, 0, end):
+                    if first is not None and opening.start() >= first:
+                        break
+                    if opening.end() > opening.start() and re.compile(expand_exit(exit, opening), re.M).search(text, opening.end(), end) is None:
+                        first = opening.start()
+                        break
+            else:
+                # Every enter match before the start of the last exit match is closed before end
+                last = 0
+                for closing in exit.finditer(text, 0, end):
+                    last = closing.start()
+                for opening in enter.finditer(text, 0, end):
+                    if first is not None and opening.start() >= first:
+                        break
+                    if opening.end() > max(last, opening.start()):
+                        first = opening.start()
+                        break
+        return first
+
+    def get_dispatch_master(self, char):
+        """Return the master pattern restricted to the variants that can start with char, its groups, the indexes of
+           the regex variants and the group of the literal variants (None if there is none).
+           The literal variants share one lookahead, a trie giving the longest literal at the position."""
+        candidates, regexes = self.get_dispatch(char)
+        if candidates not in self.masters:
+            # One optional lookahead per variant, in priority order: a single match gives the greedy length of each
+            master = ''.join(lookahead(index, self.variants[index][2]) for index in regexes)
+            words = {self.literals[index] for index in candidates if self.literals[index] is not None}
+            if len(words) > 0:
+                master += f'(?=(?P<literal>{trie_pattern(words)}))?'
+            master = re.compile(master)
+            literal_group = master.groupindex['literal'] if len(words) > 0 else None
+            self.masters[candidates] = (master, [master.groupindex[f'v{index}'] for index in regexes], regexes, literal_group)
+        return self.masters[candidates]
+
+    def get_conflicts(self):
+        """Return the literal variants that overlap with another variant, as tuples (kind, type, literal, other type, other pattern).
+           shadowed: an earlier variant matches the whole literal, so the literal never gives its type.
+           overlap: a later regex matches the whole literal too, the literal wins (like a keyword over an identifier)."""
+        self.compile()
+        conflicts = []
+        for index, text in enumerate(self.literals):
+            if text is None:
+                continue
+            typ = self.variants[index][0]
+            for other, (other_typ, elem, _) in enumerate(self.variants):
+                if other == index or (self.literals[other] is not None and other > index):
+                    continue
+                if self.literals[other] == text or (self.literals[other] is None and elem.fullmatch(text) is not None):
+                    kind = 'shadowed' if other < index else 'overlap'
+                    conflicts.append((kind, typ, text, other_typ, elem.pattern))
+                    if kind == 'shadowed':
+                        break
+        return conflicts
+
     def get_number_of_types(self):
-        return len(self.definitions)
+        return len(self.sources)
 
     def get_number_of_regex(self):
         total = 0
-        for k, v in enumerate(self.definitions):
-            total += len(v)
+        for variants in self.sources.values():
+            total += len(variants)
         return total
 
     def __str__(self):
@@ -91,6 +410,16 @@ class Language:
 # Globals and constants
 #-------------------------------------------------------------------------------
 
+# Categories of characters used in regex classes, for first_chars and can_start
+CATEGORIES = {
+    'CATEGORY_DIGIT': re.compile('\\d'),
+    'CATEGORY_NOT_DIGIT': re.compile('\\D'),
+    'CATEGORY_SPACE': re.compile('\\s'),
+    'CATEGORY_NOT_SPACE': re.compile('\\S'),
+    'CATEGORY_WORD': re.compile('\\w'),
+    'CATEGORY_NOT_WORD': re.compile('\\W'),
+}
+
 # Shared definitions
 IDENTIFIER   = ['[@_]&*']
 WRONG_INT    = ['[123456789]#*@&*', '0[aAbCdDeEfFgGhHiIjJkKlLmMnNoOpPqQrRsStTuUvVwWyYzZ]#*@&*', '00#*@&*']
@@ -180,8 +509,7 @@ LANGUAGES = {
                          '\\.', '\\.\\.',
                          '#', ':'],
             'separator': ['\\{', '\\}', '\\(', '\\)', '\\[', '\\]', ',', ';'],
-            'comment': ['--(?!\\[\\[).*(\n|$)', '--\\[\\[[\\s\\S]*--\\]\\](\n|$)'],
-            'intermediate_comment': ['--\\[\\[[\\s\\S]*'],
+            'comment': ['--(?!\\[=*\\[).*(\n|$)'],
             'newline' : PATTERNS['NEWLINES'],
             'blank': PATTERNS['BLANKS'],
             'wrong_int' : PATTERNS['WRONG_INTEGER'],
@@ -189,6 +517,12 @@ LANGUAGES = {
         ['wrong_integer'],
         {
             'ante_identifier': ['function'],
+        },
+        # As in Lua, a long bracket opens wherever it is: f[[text]] is a call with a string,
+        # and ]] closes a long comment (--]] is only the usual way to write its end).
+        {
+            'comment': [('--\\[(=*)\\[', '\\]\\1\\](\n)?', 'intermediate_comment')],
+            'string': [('\\[(=*)\\[', '\\]\\1\\]')],
         }
     ),
     'python': Language('python',
@@ -213,6 +547,11 @@ LANGUAGES = {
             'newline' : PATTERNS["NEWLINES"],
             'blank': PATTERNS["BLANKS"],
             'wrong_int' : PATTERNS["WRONG_INTEGER"],
+        },
+        None,
+        None,
+        {
+            'string': [('"""', '(?<!\\\\)"""'), ("'''", "(?<!\\\\)'''")],
         }
     ),
     'text': Language('text',
@@ -292,6 +631,11 @@ LANGUAGES = {
         # Special
         {
             'ante_identifier': ['module', 'class', 'def']
+        },
+        {
+            'comment': [('^=begin\\b', '^=end\\b[^\n]*')],
+            # Not after an operand: 1<<SHIFT is a shift, puts <<EOS a heredoc
+            'string': [('(?<![\\w)\\]])<<[~-]?([A-Z_][A-Z_0-9]*)\\b', '^[ \\t]*\\1$')],
         }
     ),
     'bnf': Language('bnf',
@@ -31,8 +31,16 @@
 #-------------------------------------------------------------------------------
 
 from weyland.languages import Language, LANGUAGES, PATTERNS
+from weyland.scanners import SCANNERS
+from array import array
+from bisect import bisect_right
+from collections.abc import MutableMapping
+import hashlib
 import html
+import mmap
+import os
 import re
+import time
 
 #-------------------------------------------------------------------------------
 # Functions
@@ -41,12 +49,86 @@ import re
 def ln(s):
     return s.replace('\n', '<NL>')
 
+def escape(val):
+    """Escape &, < and >. Most tokens have none of them and are returned without a copy."""
+    if '&' in val:
+        val = val.replace('&', '&amp;')
+    if '>' in val:
+        val = val.replace('>', '&gt;')
+    if '<' in val:
+        val = val.replace('<', '&lt;')
+    return val
+
+def open_buffer(source):
+    """Return a bytes-like object for source: a path, mapped in memory, or bytes, bytearray, memoryview or mmap"""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b''
+            # The map stays valid after the file is closed
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return source
+
+def find_token(tokens, position, low=0):
+    """Return the index of the last token starting at or before position, -1 if there is none"""
+    high = len(tokens)
+    while low < high:
+        middle = (low + high) // 2
+        if tokens[middle].start <= position:
+            low = middle + 1
+        else:
+            high = middle
+    return low - 1
+
 #-------------------------------------------------------------------------------
 # Classes
 #-------------------------------------------------------------------------------
 
 class LexingException(Exception):
-    pass
+
+    def __init__(self, message, position=None, line=None, column=None):
+        super().__init__(message)
+        self.position = position
+        self.line = line
+        self.column = column
+
+    @staticmethod
+    def located(message, text, position):
+        """Return an exception for position in text, with its line and column"""
+        line, column = LineIndex(text).get_position(position)
+        return LexingException(message, position, line, column)
+
+    def __str__(self):
+        if self.line is None:
+            return super().__str__()
+        return f'{self.args[0]} at line {self.line}, column {self.column}'
+
+
+class LineIndex:
+    """Offsets of the starts of the lines of a text, built once. A position is mapped to its line by binary search.
+
+    Lines and columns start at 1. The text can be a bytes-like object, then columns are counted in bytes.
+    """
+
+    def __init__(self, text):
+        code = 'I' if len(text) < 2 ** 32 else 'Q'
+        newline = '\n' if isinstance(text, str) else NEWLINE
+        self.starts = array(code, [0])
+        self.starts.extend(match.end() for match in re.finditer(newline, text))
+
+    def get_line(self, position):
+        return bisect_right(self.starts, position)
+
+    def get_position(self, position):
+        """Return the line and the column of position"""
+        line = bisect_right(self.starts, position)
+        return line, position - self.starts[line - 1] + 1
+
+    def get_offset(self, line, column):
+        return self.starts[line - 1] + column - 1
+
+    def __len__(self):
+        return len(self.starts)
 
 
 class Token:
@@ -80,6 +162,210 @@ class Token:
         return f"Token {self.typ:20s}  |{(ln(self.value) + '|'):10s}  {len(self.value)} @{self.start}"
 
 
+class TokenArray:
+    """Tokens stored in parallel typed arrays of type ids, starts and lengths.
+
+    The values are sliced from the text on demand. Indexing or iterating gives Token objects.
+    The text can be a bytes-like object, then the positions are in bytes and the values are decoded with encoding.
+    """
+
+    def __init__(self, text, types=None, encoding=None):
+        self.text = text
+        self.encoding = encoding
+        self.lines = None
+        self.types = [] if types is None else list(types) # type id => type name
+        self.ids = {typ: index for index, typ in enumerate(self.types)}
+        self.type_ids = array('H')
+        position_code = 'I' if len(text) < 2 ** 32 else 'Q'
+        self.starts = array(position_code)
+        self.lengths = array(position_code)
+
+    def append(self, typ, start, end):
+        if typ not in self.ids:
+            self.ids[typ] = len(self.types)
+            self.types.append(typ)
+        self.type_ids.append(self.ids[typ])
+        self.starts.append(start)
+        self.lengths.append(end - start)
+
+    def get_type(self, index):
+        return self.types[self.type_ids[index]]
+
+    def get_value(self, index):
+        start = self.starts[index]
+        if self.encoding is not None:
+            return str(self.text[start:start + self.lengths[index]], self.encoding)
+        return self.text[start:start + self.lengths[index]]
+
+    def get_start(self, index):
+        return self.starts[index]
+
+    def get_token(self, index):
+        return Token(self.get_type(index), self.get_value(index), self.starts[index])
+
+    def get_line_index(self):
+        """Return the LineIndex of the text, built on first call"""
+        if self.lines is None:
+            self.lines = LineIndex(self.text)
+        return self.lines
+
+    def get_position(self, index):
+        """Return the line and the column of the start of the token number index"""
+        return self.get_line_index().get_position(self.starts[index])
+
+    def get_memory(self):
+        """Size in bytes of the arrays, without the text"""
+        return sum(a.itemsize * len(a) for a in (self.type_ids, self.starts, self.lengths))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.get_token(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('token index out of range')
+        return self.get_token(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.get_token(index)
+
+    def __repr__(self):
+        return f"<TokenArray of {len(self)} tokens>"
+
+
+class ChunkPositions:
+    """Positions in bytes of the tokens of a chunk decoded from a buffer in utf8, asked in order"""
+
+    def __init__(self, chunk, position):
+        self.chunk = chunk
+        self.ascii = chunk.isascii()
+        self.position = position # of the chunk in the buffer
+        # Characters and bytes differ: the lengths in bytes are computed token after token
+        self.offset = position
+        self.last = 0
+
+    def get(self, typ, start, stop):
+        if self.ascii:
+            return typ, self.position + start, self.position + stop
+        if start > self.last:
+            self.offset += len(self.chunk[self.last:start].encode('utf8'))
+        length = len(self.chunk[start:stop].encode('utf8'))
+        first = self.offset
+        self.offset += length
+        self.last = stop
+        return typ, first, first + length
+
+
+class LexerStats:
+    """Counters of a lexer, filled by scan once enabled with Lexer.enable_stats. Export them with to_dict."""
+
+    def __init__(self, lexer):
+        self.lexer = lexer
+        self.reset()
+
+    def reset(self):
+        self.texts = 0
+        self.characters = 0
+        self.tokens = {} # type => number of tokens emitted
+        # first character => number of times the regex variants that can start with it were tried:
+        # calls to match with the prefix engine, matches of a master pattern else
+        self.dispatches = {}
+        self.checks = {} # index of a variant => fullmatch done to find the type of a word with the master engine
+        self.match_time = 0.0 # seconds spent finding the tokens, mostly in match or in the master patterns
+        self.visions = 0 # look-ahead retries of the prefix engine
+        # Regex tried and regex skipped thanks to the first character dispatch.
+        # With the master engine, a try is one match of a restricted master pattern.
+        self.tried = 0
+        self.avoided = 0
+
+    def record(self, char, matches, began):
+        """Count matches for a word starting with char, found since began"""
+        self.dispatches[char] = self.dispatches.get(char, 0) + matches
+        self.match_time += time.perf_counter() - began
+
+    def get_attempts(self):
+        """Return the number of regex attempts by variant index"""
+        attempts = dict(self.checks)
+        for char, count in self.dispatches.items():
+            for index in self.lexer.lang.get_dispatch(char)[1]:
+                attempts[index] = attempts.get(index, 0) + count
+        return attempts
+
+    def to_dict(self):
+        variants = self.lexer.lang.get_variants()
+        attempts = sorted(self.get_attempts().items(), key=lambda item: (-item[1], item[0]))
+        return {
+            'language': self.lexer.lang.get_name(),
+            'texts': self.texts,
+            'characters': self.characters,
+            'tokens': dict(self.tokens),
+            'attempts': [{'type': variants[index][0], 'pattern': variants[index][1].pattern, 'attempts': count} for index, count in attempts],
+            'matches': sum(self.dispatches.values()),
+            'match_time': self.match_time,
+            'visions': self.visions,
+            'tried': self.tried,
+            'avoided': self.avoided,
+        }
+
+
+class Checkpoints:
+    """Positions of a text where lexing can resume, about every `every` characters.
+
+    Both engines only look at the text after the start of a token, so a checkpoint is the start of a token
+    and the number of tokens before it, which keeps the numbers of the tokens in the HTML. Build them with
+    Lexer.checkpoint and use them with Lexer.lex_window and Lexer.to_html_window. to_dict gives a JSON object.
+    """
+
+    def __init__(self, language, engine, length, every, digest, offsets=None, indexes=None):
+        self.language = language
+        self.engine = engine
+        self.length = length
+        self.every = every
+        self.digest = digest # hash of the text, checked by is_valid
+        position_code = 'I' if length < 2 ** 32 else 'Q'
+        self.offsets = array(position_code, [0] if offsets is None else offsets)
+        self.indexes = array(position_code, [0] if indexes is None else indexes)
+
+    @staticmethod
+    def hash(text):
+        return hashlib.sha256(text.encode('utf8')).hexdigest()
+
+    def add(self, offset, index):
+        self.offsets.append(offset)
+        self.indexes.append(index)
+
+    def find(self, position):
+        """Return the offset and the token number of the last checkpoint at or before position"""
+        found = bisect_right(self.offsets, position) - 1
+        return self.offsets[found], self.indexes[found]
+
+    def is_valid(self, text):
+        """Check that the checkpoints were built on this text. It reads the whole text."""
+        return len(text) == self.length and Checkpoints.hash(text) == self.digest
+
+    def to_dict(self):
+        return {
+            'language': self.language,
+            'engine': self.engine,
+            'length': self.length,
+            'every': self.every,
+            'digest': self.digest,
+            'offsets': self.offsets.tolist(),
+            'indexes': self.indexes.tolist(),
+        }
+
+    @staticmethod
+    def from_dict(data):
+        return Checkpoints(data['language'], data['engine'], data['length'], data['every'], data['digest'], data['offsets'], data['indexes'])
+
+    def __len__(self):
+        return len(self.offsets)
+
+
 class Mini:
 
     def __init__(self, typ, elem, start):
@@ -90,37 +376,210 @@ class Mini:
 
 class Lexer:
 
-    def __init__(self, lang, discards=None):
+    # prefix: grows a word character by character and tries every regex on it (reference engine)
+    # master: takes at each position the longest match given by the master pattern of its first character
+    # The two engines differ when a longer match exists past a length where neither the word
+    # nor its vision (the word and the next character) match: prefix stops, master goes on.
+    # See ENGINE_DIFFERENCES: game names with two spaces, [[link]] in hamill, and names that
+    # prefix rejects. The samples of bench.SAMPLES give the same tokens with both, see test_engines.
+    ENGINES = ['prefix', 'master']
+    # fast: dedicated scanner of the language in scanners.SCANNERS, chosen by default when there is one
+    FAST = 'fast'
+
+    def __init__(self, lang, discards=None, engine=None):
         self.lang = lang
         self.discards = [] if discards is None else discards
+        if engine is None:
+            engine = Lexer.FAST if lang.name in SCANNERS else 'prefix'
+        self.check_engine(engine)
+        self.engine = engine
+        self.html_parts = {} # {type: (opening of the span, closing of the span)}
+        self.compact_parts = {} # {type: opening of the span} for to_compact_html
+        self.stats = None # LexerStats when enabled
 
     def get_language(self):
         return self.lang
 
+    def check_engine(self, engine):
+        if engine == Lexer.FAST and self.lang.name not in SCANNERS:
+            raise LexingException(f"No fast scanner for language {self.lang.name}, fast is available for {list(SCANNERS)}")
+        elif engine not in Lexer.ENGINES and engine != Lexer.FAST:
+            raise LexingException(f"Unknown engine {engine}. Engine should be in {Lexer.ENGINES + [Lexer.FAST]}")
+
+    def enable_stats(self):
+        """Start to record the counters of the lexer and return them"""
+        if self.stats is None:
+            self.stats = LexerStats(self)
+        return self.stats
+
+    def disable_stats(self):
+        self.stats = None
+
+    def get_stats(self):
+        return self.stats
+
     def match(self, start, word, debug=False):
         matches = []
-        for typ, variants in self.lang.get_type_definitions():
-            for elem in variants:
-                m = elem.fullmatch(word)
-                if m is not None:
-                    if debug:
-                        print(f"    Match: {typ} : {elem} => {m}")
-                    matches.append(Mini(typ, elem, start))
+        variants = self.lang.get_variants()
+        candidates, regexes = self.lang.get_dispatch(word[0])
+        if self.stats is not None:
+            self.stats.tried += len(regexes)
+            self.stats.avoided += len(variants) - len(regexes)
+        # A literal variant only matches its own text: a dictionary probe replaces its regex.
+        # The literals equal to word are put among the regex matches in priority order.
+        literals = self.lang.get_literal(word) if len(regexes) < len(candidates) else ()
+        next_literal = 0
+        for index in regexes:
+            while next_literal < len(literals) and literals[next_literal] < index:
+                typ, elem, _ = variants[literals[next_literal]]
+                matches.append(Mini(typ, elem, start))
+                next_literal += 1
+            typ, elem, _ = variants[index]
+            m = elem.fullmatch(word)
+            if m is not None:
+                if debug:
+                    print(f"    Match: {typ} : {elem} => {m}")
+                matches.append(Mini(typ, elem, start))
+        for index in literals[next_literal:]:
+            typ, elem, _ = variants[index]
+            matches.append(Mini(typ, elem, start))
         return matches
 
-    def lex(self, text, discards=None, debug=False):
+    def lex(self, text, discards=None, debug=False, engine=None):
+        return list(self.iter_tokens(text, discards, debug, engine))
+
+    def lex_compact(self, text, discards=None, engine=None):
+        """Lex text into a TokenArray, without creating a Token object by token"""
+        tokens = TokenArray(text)
+        append = tokens.append
+        for typ, start, end in self.scan(text, discards, False, engine):
+            append(typ, start, end)
+        return tokens
+
+    def lex_buffer(self, source, discards=None, engine=None, chunk_size=None):
+        """Lex a file or a bytes-like object in utf8 into a TokenArray of byte positions, see scan_buffer"""
+        buffer = open_buffer(source)
+        tokens = TokenArray(buffer, None, 'utf8')
+        append = tokens.append
+        for typ, start, end in self.scan_buffer(buffer, discards, engine, chunk_size):
+            append(typ, start, end)
+        return tokens
+
+    def scan_buffer(self, source, discards=None, engine=None, chunk_size=None):
+        """Yield the type, start and end in bytes of the tokens of a file or a bytes-like object in utf8.
+
+        A file is mapped in memory. Only chunks of about chunk_size bytes, cut after a newline,
+        are decoded one at a time, so the memory used does not depend on the size of the file.
+        The cut can fall inside a token (a json string with a newline, \\n\\r): the last token of a chunk,
+        or the token before an error, is lexed again at the start of the next chunk. When no token can be
+        taken from a chunk, the next one is twice as big: the memory used goes up to the longest token,
+        and to the rest of the buffer for an error, raised only by the chunk at the end of the buffer.
+        It is only possible for the languages of BYTES_LANGUAGES.
+        """
+        if self.lang.name not in BYTES_LANGUAGES:
+            raise LexingException(f"Language {self.lang.name} can't be lexed by chunks, choose in {BYTES_LANGUAGES}")
+        discards = self.discards if discards is None else discards
+        buffer = open_buffer(source)
+        chunk_size = CHUNK_SIZE if chunk_size is None else chunk_size
+        size = len(buffer)
+        position = 0
+        lines = 0 # lines before the chunk, for the errors
+        columns = 0 # characters of the line before the chunk, for the errors
+        grow = 1 # multiplies chunk_size when no token could be taken from the last chunk
+        while position < size:
+            cut = NEWLINE.search(buffer, min(position + chunk_size * grow, size) - 1)
+            end = size if cut is None else cut.end()
+            chunk = str(buffer[position:end], 'utf8')
+            final = end == size
+            located = ChunkPositions(chunk, position)
+            pending = None # the last token lexed, only taken when the chunk is the final one
+            try:
+                for token in self.scan(chunk, [], False, engine):
+                    if pending is not None and pending[0] not in discards:
+                        yield located.get(*pending)
+                    pending = token
+            except LexingException as e:
+                if not final:
+                    pass # the error can come from the cut, it is checked again in the next chunk
+                elif e.line is None:
+                    raise
+                else:
+                    if pending is not None and pending[0] not in discards:
+                        yield located.get(*pending)
+                    column = e.column + columns if e.line == 1 else e.column
+                    raise LexingException(e.args[0], position + len(chunk[:e.position].encode('utf8')), lines + e.line, column) from None
+            if final:
+                if pending is not None and pending[0] not in discards:
+                    yield located.get(*pending)
+                return
+            restart = 0 if pending is None else pending[1]
+            grow = 1 if restart > 0 else grow * 2
+            lines += chunk.count('\n', 0, restart)
+            newline = chunk.rfind('\n', 0, restart)
+            columns = columns + restart if newline == -1 else restart - newline - 1
+            position += len(chunk[:restart].encode('utf8'))
+
+    def iter_tokens(self, text, discards=None, debug=False, engine=None, position=0):
+        """Yield the tokens of text one by one from position, without keeping them"""
+        for typ, start, end in self.scan(text, discards, debug, engine, position):
+            yield Token(typ, text[start:end], start)
+
+    def scan(self, text, discards=None, debug=False, engine=None, position=0):
+        """Yield the type, start and end of the tokens of text from position"""
+        engine = self.engine if engine is None else engine
+        if self.stats is not None:
+            self.stats.texts += 1
+            self.stats.characters += len(text) - position
+        if engine == 'master':
+            return self.scan_master(text, discards, debug, position)
+        elif engine == 'prefix':
+            return self.scan_prefix(text, discards, debug, position)
+        elif engine == Lexer.FAST:
+            return self.scan_fast(text, discards, debug, position)
+        self.check_engine(engine)
+
+    def scan_fast(self, text, discards=None, debug=False, position=0):
+        discards = self.discards if discards is None else discards
+        self.check_engine(Lexer.FAST)
+        tokens = SCANNERS[self.lang.name](self.lang, text, discards, position)
+        if self.stats is None and not debug:
+            return tokens
+        return self.follow(tokens, text, debug)
+
+    def follow(self, tokens, text, debug):
+        """Count and print the tokens of a scanner"""
+        for typ, start, end in tokens:
+            if debug:
+                print(f"@{start} |{ln(text[start:end])}| {typ}")
+            if self.stats is not None:
+                self.stats.tokens[typ] = self.stats.tokens.get(typ, 0) + 1
+            yield typ, start, end
+
+    def scan_prefix(self, text, discards=None, debug=False, position=0):
         discards = self.discards if discards is None else discards
+        stats = self.stats
+        if stats is not None:
+            began = time.perf_counter()
+        calls = 0 # calls to match for the current word
+        blocks = self.lang.has_blocks()
         word = ''
         old = None
         matched = []
-        tokens = []
-        start = 0
-        i = 0
+        start = position
+        i = position
         while i < len(text):
+            if blocks and word == '':
+                block = self.lang.find_block(text, i)
+                if block is not None:
+                    yield from self.emit_block(block, text, i, discards, debug)
+                    old = []
+                    start = i = block[1]
+                    continue
             word += text[i]
             if debug:
                 print(f"{i}. @{start} |{ln(word)}|")
             matched = self.match(start, word, debug)
+            calls += 1
             if debug and len(matched) == 0:
                 print('    no match this turn')
             if len(matched) == 0 and (old is None or len(old) == 0):
@@ -129,65 +588,346 @@ class Lexer:
             elif len(matched) == 0: # old is not None and old.length > 0
                 # Visions: trying to see if there is something after
                 if i + 1 < len(text):
+                    if stats is not None:
+                        stats.visions += 1
                     future_index = i + 1
                     future_word = word + text[future_index]
                     matched = self.match(start, future_word, debug)
+                    calls += 1
                     if debug and len(matched) > 0:
                         print('    vision of the future OK')
                 # Si et seulement si dans le futur on n'aura rien on fait un jeton, sinon on continue
                 if len(matched) == 0:
                     content = word[0:len(word)-1]
+                    if stats is not None:
+                        stats.record(word[0], calls, began)
+                    calls = 0
                     if debug:
                         print(f'pour le mot |{content}| nous avons :')
                         for res in old:
                             print(f"    {res.typ} : {res.elem} @{res.start}")
                     if self.lang.is_wrong(old[0].typ):
-                       raise LexingException(f'A wrong token definition {old[0].typ} : {old[0].elem} has been validated by the lexer: {content}')
+                       raise LexingException.located(f'A wrong token definition {old[0].typ} : {old[0].elem} has been validated by the lexer: {content}', text, start)
                     if old[0].typ not in discards:
-                        tokens.append(Token(old[0].typ, content, old[0].start))
                         if debug:
-                            print('token emis: ' + repr(tokens[-1]))
+                            print('token emis: ' + repr(Token(old[0].typ, content, old[0].start)))
+                        if stats is not None:
+                            stats.tokens[old[0].typ] = stats.tokens.get(old[0].typ, 0) + 1
+                        yield old[0].typ, old[0].start, old[0].start + len(content)
                     word = ''
                     start = i
                     i -= 1
+                    if stats is not None:
+                        began = time.perf_counter()
             old = matched
             matched =[]
             i += 1
-        if len(old) > 0:
+        if old is not None and len(old) > 0:
             content = word
+            if stats is not None:
+                stats.record(word[0], calls, began)
             if debug:
                 print('pour le mot ' + content + ' nous avons :')
                 for res in old:
                     print(f'    {res.typ} : {res.elem}')
             if self.lang.is_wrong(old[0].typ):
-                raise LexingException(f'A wrong token definition {old[0].typ} : {old[0].elem} has been validated by the lexer: {content}')
+                raise LexingException.located(f'A wrong token definition {old[0].typ} : {old[0].elem} has been validated by the lexer: {content}', text, start)
             if old[0].typ not in discards:
-                tokens.append(Token(old[0].typ, content, old[0].start))
                 if debug:
-                    print('token emis: ' + repr(tokens[-1]))
+                    print('token emis: ' + repr(Token(old[0].typ, content, old[0].start)))
+                if stats is not None:
+                    stats.tokens[old[0].typ] = stats.tokens.get(old[0].typ, 0) + 1
+                yield old[0].typ, old[0].start, old[0].start + len(content)
         elif len(word) > 0:
-            raise LexingException(f'Text not lexed at the end for lang {self.lang}: |{word}| in |{ln(text)}| for {self.lang}')
-        return tokens
+            raise LexingException.located(f'Text not lexed at the end for lang {self.lang}: |{ln(word)}|', text, start)
+
+    def scan_master(self, text, discards=None, debug=False, position=0):
+        discards = self.discards if discards is None else discards
+        variants = self.lang.get_variants()
+        literals = self.lang.get_literal_variants()
+        stats = self.stats
+        blocks = self.lang.has_blocks()
+        start = position
+        while start < len(text):
+            if blocks:
+                block = self.lang.find_block(text, start)
+                if block is not None:
+                    yield from self.emit_block(block, text, start, discards, debug)
+                    start = block[1]
+                    continue
+            # Only the variants that can start with this character are in the pattern
+            if stats is not None:
+                began = time.perf_counter()
+            master, groups, candidates, literal_group = self.lang.get_dispatch_master(text[start])
+            if stats is not None:
+                stats.tried += 1
+                stats.avoided += len(variants) - len(candidates)
+            regs = master.match(text, start).regs
+            ends = [regs[g][1] for g in groups]
+            end = max(ends, default=-1)
+            # The literal variants share one group giving the longest literal
+            literal_end = -1 if literal_group is None else regs[literal_group][1]
+            if literal_end > end:
+                end = literal_end
+            if end <= start:
+                raise LexingException.located(f'Text not lexed for lang {self.lang}: |{ln(text[start:start + 20])}|', text, start)
+            # The type is the first one having a variant matching the whole word, like in the prefix engine.
+            # The first regex variant whose greedy match has the right length is sure to match, before it we check.
+            if literal_end != end:
+                found = ends.index(end)
+                for previous in range(found):
+                    if ends[previous] != -1:
+                        if stats is not None:
+                            stats.checks[candidates[previous]] = stats.checks.get(candidates[previous], 0) + 1
+                        if variants[candidates[previous]][2].fullmatch(text, start, end) is not None:
+                            found = previous
+                            break
+                found = candidates[found]
+            else:
+                # The word is a literal: a dictionary probe gives its first variant
+                found = literals[text[start:end]][0]
+                if len(candidates) > 0 and candidates[0] < found:
+                    for previous, index in enumerate(candidates):
+                        if index >= found:
+                            break
+                        if ends[previous] != -1:
+                            if stats is not None:
+                                stats.checks[index] = stats.checks.get(index, 0) + 1
+                            if variants[index][2].fullmatch(text, start, end) is not None:
+                                found = index
+                                break
+            typ, elem, _ = variants[found]
+            if stats is not None:
+                stats.dispatches[text[start]] = stats.dispatches.get(text[start], 0) + 1
+                stats.match_time += time.perf_counter() - began
+            if debug:
+                print(f"@{start} |{ln(text[start:end])}| {typ} : {elem}")
+            if self.lang.is_wrong(typ):
+                raise LexingException.located(f'A wrong token definition {typ} : {elem} has been validated by the lexer: {text[start:end]}', text, start)
+            if typ not in discards:
+                if stats is not None:
+                    stats.tokens[typ] = stats.tokens.get(typ, 0) + 1
+                yield typ, start, end
+            start = end
+
+    def emit_block(self, block, text, start, discards, debug=False):
+        """Yield the token of a block found by Language.find_block, unless its type is discarded"""
+        typ, end = block
+        if debug:
+            print(f"@{start} |{ln(text[start:end])}| {typ} : block")
+        if typ not in discards:
+            if self.stats is not None:
+                self.stats.tokens[typ] = self.stats.tokens.get(typ, 0) + 1
+            yield typ, start, end
+
+    def checkpoint(self, text, every=None, engine=None):
+        """Lex text once and return the Checkpoints at the first token starting after each multiple of every"""
+        every = CHECKPOINT_EVERY if every is None else every
+        engine = self.engine if engine is None else engine
+        checkpoints = Checkpoints(self.lang.get_name(), engine, len(text), every, Checkpoints.hash(text))
+        following = every
+        for index, (_, start, _) in enumerate(self.scan(text, [], False, engine)):
+            if start >= following:
+                checkpoints.add(start, index)
+                following = (start // every + 1) * every
+        return checkpoints
+
+    def scan_window(self, text, start, end, checkpoints):
+        """Yield the number, type, start and end of the tokens of text overlapping [start, end[,
+           lexed from the last checkpoint before start"""
+        if checkpoints.language != self.lang.get_name() or checkpoints.length != len(text):
+            raise LexingException(f"Checkpoints of a text of {checkpoints.length} characters in {checkpoints.language}, "
+                                  f"not of this one of {len(text)} characters in {self.lang.get_name()}")
+        position, index = checkpoints.find(start)
+        for typ, first, last in self.scan(text, [], False, checkpoints.engine, position):
+            if first >= end:
+                break
+            if last > start:
+                yield index, typ, first, last
+            index += 1
+
+    def lex_window(self, text, start, end, checkpoints, discards=None):
+        """Return the tokens of text overlapping [start, end[, see scan_window"""
+        discards = self.discards if discards is None else discards
+        return [Token(typ, text[first:last], first) for _, typ, first, last in self.scan_window(text, start, end, checkpoints) if typ not in discards]
 
-    def to_html(self, text=None, tokens=None, raws=None):
+    def to_html_window(self, text, start, end, checkpoints, raws=None, compact=False):
+        """Return the HTML of the tokens of text overlapping [start, end[, the same as in the HTML of the whole text"""
+        raws = [] if raws is None else raws
+        if compact:
+            return self.to_compact_html(None, [Token(typ, text[first:last], first) for _, typ, first, last in self.scan_window(text, start, end, checkpoints)], raws)
+        output = []
+        write = output.append
+        parts = self.html_parts
+        for index, typ, first, last in self.scan_window(text, start, end, checkpoints):
+            if typ in raws:
+                write(text[first:last])
+            else:
+                opening, closing = parts.get(typ) or self.get_html_parts(typ)
+                write(f'{opening}{index}{closing}{escape(text[first:last])}</span>')
+        return ''.join(output)
+
+    def relex(self, text, tokens, offset, removed, inserted, discards=None, engine=None):
+        """Update tokens, lexed from the text before an edit, to match text after the edit.
+
+        The edit removed removed characters at offset and inserted the string inserted.
+        Lexing restarts at the first token of the line where the edit starts, or at the start
+        of the multiline token (like a block comment) containing it, or at the line of a block left open
+        before the edit, that the edit can close (see Language.find_open_block: for a language with
+        blocks, this is a search of the text before the edit). It stops as soon as a new token
+        starts where an old one started, strictly after the edit: both engines only look at the text
+        after the start of a token and at the character before it (for a block anchored at the start
+        of a line), so the following tokens are the same. Return the indexes of the first token
+        changed and of the first token kept after it.
+
+        The tokens after the edit are shifted by the length difference: this is O(tokens after the
+        edit), far cheaper than lexing them again (see test_relex). They are replaced by new Token
+        objects, never modified, so that another list holding the old tokens stays valid.
+        """
+        delta = len(inserted) - removed
+        # Restart point
+        first = find_token(tokens, offset - 1)
+        if self.lang.has_blocks():
+            opened = self.lang.find_open_block(text, offset)
+            if opened is not None:
+                first = min(first, find_token(tokens, opened))
+        while first > 0 and tokens[first].start > 0 and text[tokens[first].start - 1] != '\n':
+            first -= 1
+        position = tokens[first].start if first >= 0 else 0
+        first = max(first, 0)
+        # Old tokens are kept from the first one starting after the removed text
+        kept = find_token(tokens, offset + removed - 1) + 1
+        new_tokens = []
+        for token in self.iter_tokens(text, discards, False, engine, position):
+            # The character before the token must not have been edited
+            if token.start > offset + len(inserted):
+                index = find_token(tokens, token.start - delta, kept)
+                if index >= kept and tokens[index].start == token.start - delta:
+                    kept = index
+                    break
+            new_tokens.append(token)
+        else:
+            kept = len(tokens)
+        if delta != 0:
+            tokens[kept:] = [Token(token.typ, token.value, token.start + delta) for token in tokens[kept:]]
+        tokens[first:kept] = new_tokens
+        return first, first + len(new_tokens)
+
+    def to_html(self, text=None, tokens=None, raws=None, compact=False):
+        """Return the HTML of text or tokens, assembled in one join. See to_compact_html for compact."""
         raws = [] if raws is None else raws
         if text is None and tokens is None:
             raise LexingException("Nothing send to to_html")
         elif text is not None and tokens is not None:
             raise LexingException("Send to to_html text OR tokens, not both!")
+        if compact:
+            return self.to_compact_html(text, tokens, raws)
+        output = []
+        write = output.append
+        parts = self.html_parts
         if text is not None:
-            tokens = self.lex(text, [])
-        output = ''
+            # No Token object: the values are sliced directly from the text
+            for index, (typ, start, end) in enumerate(self.scan(text, [])):
+                if typ in raws:
+                    write(text[start:end])
+                else:
+                    opening, closing = parts.get(typ) or self.get_html_parts(typ)
+                    write(f'{opening}{index}{closing}{escape(text[start:end])}</span>')
+        else:
+            for index, tok in enumerate(tokens):
+                if tok.typ in raws:
+                    write(tok.value)
+                else:
+                    opening, closing = parts.get(tok.typ) or self.get_html_parts(tok.typ)
+                    write(f'{opening}{index}{closing}{escape(tok.value)}</span>')
+        return ''.join(output)
+
+    def to_compact_html(self, text=None, tokens=None, raws=None):
+        """Return a lighter HTML of text or tokens: spans with only a class, one span for adjacent tokens of
+           the same type and no span for the raws, the types discarded by the lexer and the blank tokens"""
+        raws = [] if raws is None else raws
+        if text is not None:
+            pairs = ((typ, text[start:end]) for typ, start, end in self.scan(text, []))
+        else:
+            pairs = ((tok.typ, tok.value) for tok in tokens)
+        output = []
+        write = output.append
+        parts = self.compact_parts
+        discards = self.discards
+        current = None # type of the open span
+        for typ, value in pairs:
+            if typ in raws or typ in discards or value.isspace():
+                if current is not None:
+                    write('</span>')
+                    current = None
+                write(value if typ in raws else escape(value))
+            else:
+                if typ != current:
+                    if current is not None:
+                        write('</span>')
+                    write(parts.get(typ) or self.get_compact_part(typ))
+                    current = typ
+                write(escape(value))
+        if current is not None:
+            write('</span>')
+        return ''.join(output)
+
+    def get_compact_part(self, typ):
+        if typ not in self.compact_parts:
+            self.compact_parts[typ] = f'<span class="{self.lang.get_name()}-{typ}">'
+        return self.compact_parts[typ]
+
+    def get_html_parts(self, typ):
+        """Return the parts of the span of a token type around its index, built once by type"""
+        if typ not in self.html_parts:
+            self.html_parts[typ] = (f'<span class="{self.lang.get_name()}-{typ}" title="token n°', f' : {typ}">')
+        return self.html_parts[typ]
+
+    def iter_html(self, text=None, tokens=None, raws=None):
+        """Yield the HTML of each token as soon as it is lexed. tokens can be any iterable of Token"""
+        raws = [] if raws is None else raws
+        if text is None and tokens is None:
+            raise LexingException("Nothing send to to_html")
+        elif text is not None and tokens is not None:
+            raise LexingException("Send to to_html text OR tokens, not both!")
+        if text is not None:
+            tokens = self.iter_tokens(text, [])
         for index, tok in enumerate(tokens):
             if tok.get_type() in raws:
-                output += tok.get_value()
+                yield tok.get_value()
             else:
-                val = tok.get_value()
-                val = val.replace('&', '&amp;')
-                val = val.replace('>', '&gt;')
-                val = val.replace('<', '&lt;')
-                output += f'<span class="{self.lang.get_name()}-{tok.get_type()}" title="token n°{index} : {tok.get_type()}">{val}</span>'
-        return output
+                opening, closing = self.get_html_parts(tok.get_type())
+                yield f'{opening}{index}{closing}{escape(tok.get_value())}</span>'
+
+
+class LexerRegistry(MutableMapping):
+    """Mapping of language names to lexers. A lexer is only built on its first lookup.
+       A lexer set for a name replaces the one of the language and its discards."""
+
+    def __init__(self, discards):
+        self.discards = discards # {name of the language: discards of its lexer}
+        self.lexers = {}
+
+    def __getitem__(self, name):
+        if name not in self.lexers:
+            if name not in self.discards:
+                raise KeyError(name)
+            self.lexers[name] = Lexer(LANGUAGES[name], self.discards[name])
+        return self.lexers[name]
+
+    def __setitem__(self, name, lexer):
+        self.lexers[name] = lexer
+        self.discards[name] = lexer.discards
+
+    def __delitem__(self, name):
+        del self.discards[name]
+        self.lexers.pop(name, None)
+
+    def __iter__(self):
+        return iter(self.discards)
+
+    def __len__(self):
+        return len(self.discards)
 
 
 class Test:
@@ -199,8 +939,8 @@ class Test:
         if self.result is None:
             raise LexingException(f"No expected results for test {text}")
 
-    def test(self, num=0, debug=False):
-        tokens = self.lexer.lex(self.text, None, debug)
+    def test(self, num=0, debug=False, engine=None):
+        tokens = self.lexer.lex(self.text, None, debug, engine)
         if len(tokens) != len(self.result):
             longuest = max(len(tokens), len(self.result))
             print("index expected        type            valeur")
@@ -215,7 +955,7 @@ class Test:
         for index, r in enumerate(self.result):
             if tokens[index].get_type() != r:
                 raise LexingException(f"Error: expected {r} and got {tokens[index].get_type()} in {self.text}")
-        print(f"[SUCCESS] Test n°{num} Lang : {self.lexer.get_language()}\nText : |{ln(self.text)}|\nResult:")
+        print(f"[SUCCESS] Test n°{num} Lang : {self.lexer.get_language()} Engine : {self.lexer.engine if engine is None else engine}\nText : |{ln(self.text)}|\nResult:")
         for tok in tokens:
             print(f'   {tok}')
 
@@ -223,8 +963,27 @@ class Test:
 # Globals and constants
 #-------------------------------------------------------------------------------
 
+# Languages in an encoding compatible with ASCII where lexing can start at any token, lexed by chunks by scan_buffer
+BYTES_LANGUAGES = ['game', 'json', 'text']
+
+# Size in bytes of the chunks of scan_buffer
+CHUNK_SIZE = 1024 * 1024
+
+# Characters between two checkpoints by default
+CHECKPOINT_EVERY = 16 * 1024
+
+NEWLINE = re.compile(b'\n')
+
+# Texts checked by test_fast before the random ones
+SAMPLES_FAST = {
+    'game': 'Far Cry, 2004; Half-Life 2, 2004\nThe Witcher 3: Wild Hunt, 2015\nDr Jekyll’s Lab, 1990\nnf230  W0Lr3cSta30, 1997\n',
+    'json': '{"a": [1, 2.5, 1e-3, 2.5E4, true, false, null],\r\n "b\\"": \'c\'}\n',
+    'text': 'Une ligne\u00A0 avec\u00A0des blancs\r\nDeux\n\rTrois\u00A0\n',
+}
+
 lex_lua = Lexer(LANGUAGES['lua'], ['blank'])
 lex_ash = Lexer(LANGUAGES['ash'], ['blank'])
+lex_ruby = Lexer(LANGUAGES['ruby'], ['blank'])
 
 TESTS = [
     Test(lex_lua, '3+5', ['number', 'operator', 'number']),
@@ -237,21 +996,453 @@ TESTS = [
              'special', 'separator', 'identifier', 'operator', 'identifier', 'separator', 'comment']),
     Test(lex_lua, '--[[Ceci est un\nz--]]', ['comment']),
     Test(lex_lua, '--[[Ceci est un\ncommentaire multiligne--]]', ['comment']),
+    Test(lex_lua, 's = [==[a ]] b]==] .. [[\nc]]', ['identifier', 'operator', 'string', 'operator', 'string']),
     Test(lex_ash, '2..3', ['number', 'operator', 'number']),
     Test(lex_ash, 'a = 5', ['identifier', 'operator', 'number'])
 ]
 
 def tests(debug=False):
     ok = 0
-    for index, t in enumerate(TESTS):
-        try:
-            t.test(index + 1, debug)
-            ok += 1
-        except Exception as e:
-            print(e)
+    for engine in Lexer.ENGINES:
+        for index, t in enumerate(TESTS):
+            try:
+                t.test(index + 1, debug, engine)
+                ok += 1
+            except Exception as e:
+                print(e)
     print('-----------------------------')
     print(f'SUCCESS: {ok:5d}')
-    print(f'FAILED:  {(len(TESTS)-ok):5d}')
+    print(f'FAILED:  {(len(TESTS) * len(Lexer.ENGINES) - ok):5d}')
+    test_relex()
+    test_compact()
+    test_html()
+    test_literals()
+    test_stats()
+    test_dispatch()
+    test_many()
+    test_blocks()
+    test_buffer()
+    test_lines()
+    test_tables()
+    test_registry()
+    test_fast()
+    test_engines()
+    test_window()
+    test_import_time()
+
+# Edits for test_relex: lexer, text before, offset, removed, inserted
+RELEX_TESTS = [
+    (lex_lua, 'a = 5\nb = 6\n', 4, 1, '42'),
+    (lex_lua, 'a = 5\nb = 6\n', 0, 0, 'local '),
+    (lex_lua, 'a = 5\nb = 6\n', 12, 0, 'c = a .. b'),
+    (lex_lua, 'a = 5\nb = 6\n', 3, 5, ''),
+    (lex_lua, 'x = 1\n--[[Ceci est un\ncommentaire--]]\ny = 2\n', 20, 0, ' long'),
+    (lex_lua, 'x = 1\n--[[Ceci est un\ncommentaire--]]\ny = 2\n', 6, 0, '--[[ a --]]\n'),
+    (lex_lua, 'x = 1\n--[[Ceci est un\ncommentaire--]]\ny = 2\n', 35, 2, ''),
+    (lex_lua, 'x = [[a\nb]]\ny = 2\n', 8, 0, ']]'),
+    (lex_lua, 'x = [[a\nb]]\ny = 2\n', 9, 2, ''),
+    (lex_ash, 'a = 2\nb = 3\n', 5, 0, '..3'),
+    (lex_ruby, 'ab\n=begin\nc\n=end\n', 2, 1, ''),
+    (lex_ruby, 'ab=begin\nc\n=end\n', 2, 0, '\n'),
+    (lex_lua, 'a', 0, 1, ''),
+    (lex_lua, 'x = [[a\nb\ny = 2\n', 9, 0, ']]'),
+    (lex_lua, 'x = [[a\nb]]\ny = 2\n', 9, 2, ''),
+    (lex_ruby, 'puts <<EOS\na\nb\n', 14, 0, 'EOS\n'),
+    (lex_ruby, 'x = 1<<EOS\na\nEOS\n', 5, 0, ' '),
+]
+
+def test_relex():
+    ok = 0
+    for engine in Lexer.ENGINES:
+        for lexer, text, offset, removed, inserted in RELEX_TESTS:
+            tokens = lexer.lex(text, None, False, engine)
+            before = [(token, token.start) for token in tokens]
+            edited = text[:offset] + inserted + text[offset + removed:]
+            lexer.relex(edited, tokens, offset, removed, inserted, None, engine)
+            if tokens != lexer.lex(edited, None, False, engine):
+                raise LexingException(f"Relex error with engine {engine} for |{ln(edited)}|: {tokens}")
+            if any(token.start != start for token, start in before):
+                raise LexingException(f"Relex has modified the old tokens with engine {engine} for |{ln(edited)}|")
+            ok += 1
+    # An edit at the start shifts every following token: it must stay far cheaper than a lexing
+    text = 'a = 5\nb = 6\n' * 5000
+    tokens = lex_lua.lex(text, None, False, 'master')
+    began = time.perf_counter()
+    lex_lua.lex(text, None, False, 'master')
+    lexing = time.perf_counter() - began
+    began = time.perf_counter()
+    lex_lua.relex('x' + text, tokens, 0, 0, 'x', None, 'master')
+    relexing = time.perf_counter() - began
+    if relexing > lexing / 4:
+        raise LexingException(f"Relex of an edit at the start too slow: {relexing:.6f}s for a lexing in {lexing:.6f}s")
+    print(f"[SUCCESS] Relex : {ok} edits, {len(tokens)} tokens shifted in {relexing:.6f}s")
+
+def test_compact():
+    ok = 0
+    for engine in Lexer.ENGINES:
+        for t in TESTS:
+            tokens = t.lexer.lex_compact(t.text, None, engine)
+            if list(tokens) != t.lexer.lex(t.text, None, False, engine) or tokens[-1] != tokens.get_token(len(tokens) - 1):
+                raise LexingException(f"TokenArray error with engine {engine} for |{ln(t.text)}|")
+            ok += 1
+    print(f"[SUCCESS] TokenArray : {ok} texts")
+
+def test_html():
+    ok = 0
+    for t in TESTS:
+        output = t.lexer.to_html(t.text + ' < & >', None, ['blank'])
+        if output != t.lexer.to_html(None, t.lexer.lex(t.text + ' < & >', []), ['blank']) or output != ''.join(t.lexer.iter_html(t.text + ' < & >', None, ['blank'])):
+            raise LexingException(f"HTML error for |{ln(t.text)}|")
+        if '&lt;' not in output or '&amp;' not in output or '&gt;' not in output:
+            raise LexingException(f"HTML not escaped for |{ln(t.text)}|: {output}")
+        compact = t.lexer.to_html(t.text + ' < & >', None, ['blank'], True)
+        if compact != t.lexer.to_html(None, t.lexer.lex(t.text + ' < & >', []), ['blank'], True) or \
+            html.unescape(re.sub('<[^>]*>', '', compact)) != t.text + ' < & >':
+            raise LexingException(f"Compact HTML error for |{ln(t.text)}|: {compact}")
+        ok += 1
+    compact = lex_lua.to_html('a = f(b))\n', None, None, True)
+    if compact != '<span class="lua-identifier">a</span> <span class="lua-operator">=</span> <span class="lua-identifier">f</span>' \
+                  '<span class="lua-separator">(</span><span class="lua-identifier">b</span><span class="lua-separator">))</span>\n':
+        raise LexingException(f"Compact HTML error: {compact}")
+    print(f"[SUCCESS] HTML : {ok} texts")
+
+def test_literals():
+    from weyland.languages import trie_pattern
+    trie = re.compile(trie_pattern(['in', 'int', 'if', '=', '==']))
+    for text, expected in [('int x', 'int'), ('in x', 'in'), ('if', 'if'), ('==>', '=='), ('i', None)]:
+        m = trie.match(text)
+        if (m.group() if m is not None else None) != expected:
+            raise LexingException(f"Trie error for |{text}|: {m}")
+    if ('shadowed', 'keyword', 'null', 'identifier', '^[_a-zA-Z]\\w*$') not in LANGUAGES['json'].get_conflicts():
+        raise LexingException(f"Conflict not found in json: {LANGUAGES['json'].get_conflicts()}")
+    print(f"[SUCCESS] Literals : {sum(1 for text in lex_lua.lang.literals if text is not None)} literal variants in lua")
+
+def test_stats():
+    import json
+    for engine in Lexer.ENGINES:
+        lexer = Lexer(LANGUAGES['lua'], ['blank'], engine)
+        stats = lexer.enable_stats()
+        total = 0
+        for t in TESTS[:6]:
+            total += len(lexer.lex(t.text))
+        exported = json.loads(json.dumps(stats.to_dict()))
+        if sum(exported['tokens'].values()) != total or exported['texts'] != 6 or exported['matches'] == 0 or len(exported['attempts']) == 0:
+            raise LexingException(f"Stats error with engine {engine}: {exported}")
+        if engine == 'prefix' and exported['visions'] == 0:
+            raise LexingException(f"No vision counted: {exported}")
+        lexer.disable_stats()
+        lexer.lex(TESTS[0].text)
+        if stats.texts != 6:
+            raise LexingException("Stats still counted when disabled")
+    print(f"[SUCCESS] Stats : {exported['matches']} matches, {exported['match_time']:.6f}s")
+
+def test_dispatch():
+    from weyland import LEXERS
+    from weyland.bench import dispatch, SAMPLES
+    for engine in Lexer.ENGINES:
+        reports = dispatch(None, engine)
+        for name, report in reports.items():
+            if report['tried'] == 0 or report['avoided'] == 0:
+                raise LexingException(f"Dispatch error with engine {engine} for {name}: {report}")
+            if LEXERS[name].get_stats() is not None:
+                raise LexingException(f"Stats left enabled by the dispatch report of {name}")
+    # Without stats, nothing is counted
+    lexer = Lexer(LANGUAGES['lua'], ['blank'], 'prefix')
+    lexer.lex(SAMPLES['lua'])
+    stats = lexer.enable_stats()
+    if stats.tried != 0 or stats.avoided != 0:
+        raise LexingException("Dispatch counted without stats")
+    ratio = sum(report['ratio'] for report in reports.values()) / len(reports)
+    print(f"[SUCCESS] Dispatch : {len(reports)} languages, {ratio:.1%} of the regex avoided on average")
+
+def test_many():
+    from weyland import LEXERS
+    from weyland.batch import lex_many, highlight_many
+    items = [('lua', t.text) if t.lexer is lex_lua else ('ash', t.text) for t in TESTS] * 3
+    serial = highlight_many(items, ['blank'], 1)
+    # threshold=0 forces the pool even for this small batch
+    if highlight_many(items, ['blank'], 2, 1, None, 0) != serial or serial[0] != lex_lua.to_html(TESTS[0].text, None, ['blank']):
+        raise LexingException("highlight_many error")
+    if lex_many(items, None, None, 2, None, None, 0) != [LEXERS[lang].lex(text) for lang, text in items]:
+        raise LexingException("lex_many error")
+    # A spawned worker imports weyland again: it must use the lexers set here, not its own LEXERS
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    original = LEXERS['lua']
+    LEXERS['sample'] = Lexer(LANGUAGES['lua'], [], 'prefix')
+    LEXERS['lua'] = Lexer(LANGUAGES['lua'], [], 'master')
+    try:
+        runtime = [('sample', text) for _, text in items] + [('lua', text) for _, text in items]
+        with ProcessPoolExecutor(2, multiprocessing.get_context('spawn')) as pool:
+            if lex_many(runtime, None, None, 2, None, pool) != [LEXERS[lang].lex(text) for lang, text in runtime]:
+                raise LexingException("lex_many error with lexers set at runtime")
+    finally:
+        del LEXERS['sample']
+        LEXERS['lua'] = original
+    print(f"[SUCCESS] Batch : {len(items) + len(runtime)} texts")
+
+def test_blocks():
+    lex_python = Lexer(LANGUAGES['python'], ['blank'])
+    cases = [
+        (lex_python, 'x = """a\n"b"\n""" + \'\'\'c\'\'\'', ['identifier', 'operator', 'string', 'operator', 'string']),
+        (lex_ruby, '=begin\na = 1\n=end\nputs <<~EOS\n  text\n  EOS\n', ['comment', 'newline', 'identifier', 'string', 'newline']),
+        (lex_lua, '--[==[ a ]] ]==]\nx', ['comment', 'identifier']),
+        (lex_lua, 'x --[[ not closed\n', ['identifier', 'intermediate_comment']),
+        # Without an exit, a block is lexed as usual, except the explicit intermediate_comment
+        (lex_ruby, 'x = 1<<SHIFT\ny = 2\n', ['identifier', 'affectation', 'integer', 'operator', 'identifier', 'newline',
+                                             'identifier', 'affectation', 'integer', 'newline']),
+        (lex_python, 'a = """b"\nc = 1\n', ['identifier', 'operator', 'string', 'string', 'newline',
+                                             'identifier', 'operator', 'integer', 'newline']),
+        (lex_lua, 'x = [[a\ny = 2\n', ['identifier', 'operator', 'separator', 'separator', 'identifier', 'newline',
+                                       'identifier', 'operator', 'number', 'newline']),
+        # As in Lua, [[ opens a long string anywhere: a[[1]] is a call of a with the string 1
+        (lex_lua, 'a[[1]]\n', ['identifier', 'string', 'newline']),
+        (lex_lua, 'a[ [1] ]\n', ['identifier', 'separator', 'separator', 'number', 'separator', 'separator', 'newline']),
+    ]
+    for engine in Lexer.ENGINES:
+        for lexer, text, expected in cases:
+            types = [token.typ for token in lexer.lex(text, None, False, engine)]
+            if types != expected:
+                raise LexingException(f"Block error with engine {engine} for |{ln(text)}|: {types}")
+        # A block is scanned in one search, whatever its length
+        text = '--[[' + 'commentaire\n' * 100000 + ']]'
+        start = time.perf_counter()
+        tokens = lex_lua.lex(text, None, False, engine)
+        elapsed = time.perf_counter() - start
+        if len(tokens) != 1 or tokens[0].value != text:
+            raise LexingException(f"Long block error with engine {engine}")
+    print(f"[SUCCESS] Blocks : {len(cases)} texts, {len(text) // 1024} KB comment in {elapsed:.6f}s")
+
+def test_buffer():
+    import tempfile
+    from weyland import LEXERS
+    texts = {
+        'json': '{"clé": [1, 2.5, true, null],\n "texte": "été"}\n',
+        'game': 'Far Cry, 2004; Blood Dragon\nLes Chevaliers de Baphomet, 1996\n',
+        'text': 'Première ligne\tavec des mots\n\nDeux\n',
+    }
+    ok = 0
+    for name, text in texts.items():
+        lexer = LEXERS[name]
+        text = text * 5
+        with tempfile.NamedTemporaryFile('w', encoding='utf8', suffix='.txt', delete=False) as f:
+            f.write(text)
+        try:
+            for engine in Lexer.ENGINES:
+                expected = [(token.typ, token.value, len(text[:token.start].encode('utf8'))) for token in lexer.lex(text, None, False, engine)]
+                # Small chunks to have many cuts
+                tokens = lexer.lex_buffer(f.name, None, engine, 16)
+                if [(token.typ, token.value, token.start) for token in tokens] != expected:
+                    raise LexingException(f"Buffer error with engine {engine} for {name}")
+                if [(typ, start) for typ, start, _ in lexer.scan_buffer(memoryview(text.encode('utf8')), None, engine)] != [(typ, start) for typ, _, start in expected]:
+                    raise LexingException(f"Memoryview error with engine {engine} for {name}")
+                ok += 1
+            del tokens
+        finally:
+            os.remove(f.name)
+    # Tokens going over the cuts: a json string with newlines and a \n\r newline in text
+    for name, text in [('json', '["ab\ncd\n\nef", 1, "\n"]\n["g\nh"]\n'), ('text', 'ab\n\rcd\n\r\n\r')]:
+        for engine in Lexer.ENGINES + [Lexer.FAST]:
+            expected = [(token.typ, token.start, token.start + len(token.value)) for token in LEXERS[name].lex(text, None, False, engine)]
+            for chunk_size in [1, 2, 3, 4, 5, 8, None]:
+                if list(LEXERS[name].scan_buffer(text.encode('utf8'), None, engine, chunk_size)) != expected:
+                    raise LexingException(f"Buffer error with engine {engine} and chunks of {chunk_size} for |{ln(text)}|")
+            ok += 1
+    try:
+        lex_lua.lex_buffer(b'a = 1\n')
+        raise AssertionError("Lua should not be lexed by chunks")
+    except LexingException:
+        pass
+    print(f"[SUCCESS] Buffer : {ok} buffers")
+
+def test_lines():
+    from weyland import LEXERS
+    text = 'a = 1\n\nb = "été"\nc = 3'
+    lines = LineIndex(text)
+    for position, expected in [(0, (1, 1)), (4, (1, 5)), (5, (1, 6)), (6, (2, 1)), (7, (3, 1)), (len(text) - 1, (4, 5))]:
+        if lines.get_position(position) != expected or lines.get_offset(*expected) != position:
+            raise LexingException(f"LineIndex error at {position}: {lines.get_position(position)} instead of {expected}")
+    tokens = lex_lua.lex_compact(text)
+    if tokens.get_position(len(tokens) - 1) != (4, 5):
+        raise LexingException(f"TokenArray position error: {tokens.get_position(len(tokens) - 1)}")
+    for engine in Lexer.ENGINES:
+        try:
+            lex_lua.lex('a = 1\nb = 2 $ 3\n', None, False, engine)
+            raise AssertionError(f"No error with engine {engine}")
+        except LexingException as e:
+            if (e.position, e.line, e.column) != (12, 2, 7):
+                raise LexingException(f"Error position with engine {engine}: {e.position} {e.line} {e.column}")
+    try:
+        sum(1 for _ in LEXERS['json'].scan_buffer(b'{"a": 1}\n' * 100 + b'{"\xc3\xa9": ?}\n', None, None, 64))
+        raise AssertionError("No error in buffer")
+    except LexingException as e:
+        if (e.position, e.line, e.column) != (907, 101, 7):
+            raise LexingException(f"Error position in buffer: {e.position} {e.line} {e.column}")
+        error = str(e)
+    print(f"[SUCCESS] Lines : {len(lines)} lines, error: {error}")
+
+# Characters of the random texts of test_fast, with the ones at the limits of the variants
+FAST_ALPHABETS = {
+    'game': 'aZé_2019 \u00A0\t\n,;:\'-’.',
+    'json': 'aetrufnl_1209.eE-"\'\\ \u00A0\t\n\r{}[]():,',
+    'text': 'ab \u00A0\t\n\r.',
+}
+
+def test_tables():
+    import tempfile
+    from weyland import tables
+    from weyland.bench import SAMPLES
+    previous = tables.CACHE_DIR
+    ok = 0
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            tables.CACHE_DIR = directory
+            if not tables.enabled():
+                print("[SKIPPED] Tables : no _sre module")
+                return
+            for name, sample in SAMPLES.items():
+                lang = LANGUAGES[name]
+                built = Language(name, lang.sources, lang.wrong, lang.specials, lang.block_sources)
+                built.compile()
+                loaded = Language(name, lang.sources, lang.wrong, lang.specials, lang.block_sources)
+                loaded.compile()
+                # The dispatch masters come from the disk, before any lexing
+                if len(loaded.masters) == 0 or len(loaded.masters) != len(built.masters):
+                    raise LexingException(f"Tables error for {name}: {len(loaded.masters)} dispatch masters loaded")
+                for engine in Lexer.ENGINES:
+                    if Lexer(loaded, [], engine).lex(sample) != Lexer(built, [], engine).lex(sample):
+                        raise LexingException(f"Tables error with engine {engine} for {name}")
+                ok += 1
+    finally:
+        tables.CACHE_DIR = previous
+    print(f"[SUCCESS] Tables : {ok} languages saved and loaded")
+
+def test_registry():
+    registry = LexerRegistry({'lua': ['blank']})
+    if registry['lua'].discards != ['blank'] or len(registry) != 1:
+        raise LexingException("Registry error: the lexer of lua is not built with its discards")
+    registry['json'] = Lexer(LANGUAGES['json'], ['blank', 'newline'])
+    if registry['json'].lang.name != 'json' or registry.discards['json'] != ['blank', 'newline'] or list(registry) != ['lua', 'json']:
+        raise LexingException("Registry error: a lexer set is not registered")
+    del registry['lua']
+    if 'lua' in registry or 'lua' in registry.lexers or len(registry) != 1:
+        raise LexingException("Registry error: a lexer deleted is still registered")
+    print(f"[SUCCESS] Registry : {len(registry)} lexer")
+
+def test_fast(cases=400, seed=17):
+    import random
+    from weyland import LEXERS
+    generator = random.Random(seed)
+    ok = 0
+    for name, alphabet in FAST_ALPHABETS.items():
+        lexer = Lexer(LANGUAGES[name], LEXERS.discards[name])
+        if lexer.engine != Lexer.FAST:
+            raise LexingException(f"Fast scanner not selected for {name}")
+        texts = [SAMPLES_FAST[name]] + [''.join(generator.choice(alphabet) for _ in range(generator.randint(1, 12))) for _ in range(cases)]
+        for text in texts:
+            results = {}
+            for engine in ['prefix', Lexer.FAST]:
+                try:
+                    results[engine] = lexer.lex(text, None, False, engine)
+                except LexingException:
+                    results[engine] = None
+            if results['prefix'] != results[Lexer.FAST]:
+                raise LexingException(f"Fast scanner of {name} differs for |{ln(text)}|: {results}")
+            ok += 1
+    print(f"[SUCCESS] Fast scanners : {ok} texts identical to the prefix engine")
+
+# Texts where the master engine does not give the tokens of the prefix engine: lexer name, text,
+# values of the tokens with prefix and master (None when the engine rejects the text)
+ENGINE_DIFFERENCES = [
+    ('game', 'Far  Cry, 2004', ['Far', '  ', 'Cry', ',', ' ', '2004'], ['Far  Cry', ',', ' ', '2004']),
+    ('hamill', '[[link]]', ['[', '[', 'link]]'], ['[[link]]']),
+    ('game', 'ab’ c', None, ['ab’ c']),
+]
+
+def test_engines():
+    from weyland import LEXERS
+    from weyland.bench import SAMPLES
+    ok = 0
+    for name, sample in SAMPLES.items():
+        for text in [sample, sample * 3]:
+            differ = compare(LEXERS[name], text)
+            if len(differ) > 0:
+                raise LexingException(f"Engines {differ} differ from prefix for the sample of {name}")
+            ok += 1
+    for name, text, *expected in ENGINE_DIFFERENCES:
+        for engine, values in zip(Lexer.ENGINES, expected):
+            try:
+                result = [token.value for token in LEXERS[name].lex(text, [], False, engine)]
+            except LexingException:
+                result = None
+            if result != values:
+                raise LexingException(f"Engine {engine} gives {result} instead of {values} for |{ln(text)}|")
+        ok += 1
+    print(f"[SUCCESS] Engines : {ok} texts as expected")
+
+def test_window(seed=5):
+    import json
+    import random
+    text = ('local t = { ["k1"] = 5 } -- Définition <&>\n--[[ long\ncomment ]]\nprint(t["k1"] .. [[\nx]])\n' * 60)
+    generator = random.Random(seed)
+    ok = 0
+    for engine in Lexer.ENGINES:
+        checkpoints = Checkpoints.from_dict(json.loads(json.dumps(lex_lua.checkpoint(text, 256, engine).to_dict())))
+        if len(checkpoints) < len(text) // 512 or not checkpoints.is_valid(text):
+            raise LexingException(f"Checkpoints error with engine {engine}: {len(checkpoints)} checkpoints")
+        tokens = lex_lua.lex(text, [], False, engine)
+        for _ in range(40):
+            start = generator.randrange(len(text))
+            end = start + generator.randrange(1, 600)
+            expected = [token for token in tokens if token.start < end and token.start + len(token.value) > start]
+            if lex_lua.lex_window(text, start, end, checkpoints, []) != expected:
+                raise LexingException(f"Window error with engine {engine} for [{start}, {end}[")
+            window = lex_lua.to_html_window(text, start, end, checkpoints, ['blank'])
+            if window not in lex_lua.to_html(None, tokens, ['blank']) or window.count('</span>') != sum(1 for token in expected if token.typ != 'blank'):
+                raise LexingException(f"HTML window error with engine {engine} for [{start}, {end}[")
+            ok += 1
+    print(f"[SUCCESS] Windows : {ok} windows with {len(checkpoints)} checkpoints")
+
+# Maximum time in seconds to import weyland in a fresh interpreter
+IMPORT_TIME_BUDGET = 0.06
+
+def import_time():
+    """Return the time in seconds taken by the import of weyland in a fresh interpreter"""
+    import os
+    import subprocess
+    import sys
+    code = 'import time; start = time.perf_counter(); import weyland; print(time.perf_counter() - start)'
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    res = subprocess.run([sys.executable, '-c', code], cwd=root, stdout=subprocess.PIPE, check=True)
+    return float(res.stdout)
+
+def test_import_time(budget=IMPORT_TIME_BUDGET):
+    duration = min(import_time() for _ in range(3))
+    if duration > budget:
+        raise LexingException(f"Importing weyland took {duration:.3f}s, over the budget of {budget:.3f}s")
+    print(f"[SUCCESS] Import time : {duration:.3f}s (budget {budget:.3f}s)")
+
+def dispatch_report(lexer, texts, engine='prefix'):
+    """Lex texts and return the number of regex tried and avoided by the first character dispatch.
+       The counters come from a LexerStats used only for this report, the one of the lexer is kept."""
+    previous = lexer.get_stats()
+    stats = lexer.stats = LexerStats(lexer)
+    try:
+        for text in texts:
+            lexer.lex(text, None, False, engine)
+    finally:
+        lexer.stats = previous
+    total = stats.tried + stats.avoided
+    return {
+        'tried': stats.tried,
+        'avoided': stats.avoided,
+        'ratio': stats.avoided / total if total > 0 else 0.0
+    }
+
+def compare(lexer, text, discards=None):
+    """Lex text with every engine and return the list of engines whose tokens differ from the prefix engine"""
+    reference = lexer.lex(text, discards, False, 'prefix')
+    return [engine for engine in Lexer.ENGINES if lexer.lex(text, discards, False, engine) != reference]
 
 if __name__ == '__main__':
     print(Token('number', 5, 0) == Token('number', 5, 0)) # True
@@ -0,0 +1,144 @@
+# -----------------------------------------------------------
+# MIT Licence (Expat License Wording)
+# -----------------------------------------------------------
+# Copyright © 2020, Damien Gouteux
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# For more information about my projects see:
+# https://xitog.github.io/dgx (in French)
+
+"""Scanners: dedicated lexing functions for the simplest languages, giving the same tokens as the prefix engine
+
+Each scanner is one pattern of named groups tried at each position. The order of the alternatives and
+a few checks after the match reproduce the rule of the prefix engine: a token ends at the first match
+followed by two characters without any match, with the type of the first variant matching it whole.
+For json and text, it is also the longest match, given by the master engine.
+"""
+
+#-------------------------------------------------------------------------------
+# Imports
+#-------------------------------------------------------------------------------
+
+import re
+
+#-------------------------------------------------------------------------------
+# Globals and constants
+#-------------------------------------------------------------------------------
+
+# A newline before the blanks: \r\n is a newline while \r alone is normal text.
+# A blank can start with no-break spaces only if a space or a tab follows them,
+# else they are normal text like in the variant [^ \t\n]*.
+TEXT = re.compile('(?P<newline>\n\r?|\r\n)|(?P<blank>[ \t][ \u00A0\t]*|\u00A0+[ \t][ \u00A0\t]*)|(?P<normal>[^ \t\n]+)')
+
+# The longest number variant is the first to match. Digits followed by a letter are a wrong integer.
+# true and false are booleans, null stays an identifier because identifier is defined before keyword.
+JSON = re.compile('(?P<identifier>[_a-zA-Z]\\w*)'
+                  '|(?P<number>\\d+\\.\\d+[eE]-?\\d+|\\d+[eE]-\\d+|\\d+\\.\\d+|\\d+(?!\\w))'
+                  '|(?P<string>\'([^\\\\\']|\\\\[\'nt])*\'|"([^\\\\"]|\\\\["nt])*")'
+                  '|(?P<separator>[{}()\\[\\],:.])'
+                  '|(?P<newline>\n\r?|\r\n)'
+                  '|(?P<blank>[ \u00A0\t]+)')
+
+JSON_BOOLEANS = ('true', 'false')
+
+# A name starts with a word character and goes on in the characters of GAME_RUN.
+# It ends at the first word character followed by two characters that can't end it, like two spaces.
+# Before the first ’, a colon ends a wrong_id and counts as a word character: the name can't end with it.
+# A year is a name of 4 digits.
+GAME = re.compile('(?P<name>\\w)|(?P<blank>[ \u00A0\t]+)|(?P<newline>\n)|(?P<separator>[,;])')
+GAME_RUN = re.compile('[\\w\'\\-: ’]*')
+GAME_BEFORE_QUOTE = re.compile('[\'\\- ]*[\\w:](?:[\'\\- ]?[\\w:])*')
+GAME_AFTER_QUOTE = re.compile('[\'\\-: ’]*\\w(?:[\'\\-: ’]?\\w)*')
+GAME_WORD = re.compile('\\w')
+GAME_YEAR = re.compile('[12][0-9][0-9][0-9]')
+
+#-------------------------------------------------------------------------------
+# Functions
+#-------------------------------------------------------------------------------
+
+def not_lexed(lang, text, position):
+    from weyland.lexer import LexingException, ln
+    return LexingException.located(f'Text not lexed for lang {lang}: |{ln(text[position:position + 20])}|', text, position)
+
+def scan_text(lang, text, discards, position=0):
+    match = TEXT.match
+    end = len(text)
+    while position < end:
+        m = match(text, position)
+        typ = m.lastgroup
+        stop = m.end()
+        if typ not in discards:
+            yield typ, position, stop
+        position = stop
+
+def scan_json(lang, text, discards, position=0):
+    match = JSON.match
+    end = len(text)
+    while position < end:
+        m = match(text, position)
+        if m is None:
+            raise not_lexed(lang, text, position)
+        typ = m.lastgroup
+        stop = m.end()
+        if typ == 'identifier' and text[position:stop] in JSON_BOOLEANS:
+            typ = 'boolean'
+        if typ not in discards:
+            yield typ, position, stop
+        position = stop
+
+def end_of_name(text, position):
+    """Return the end of the name starting at position or -1 if it can't end"""
+    run = GAME_RUN.match(text, position + 1).end()
+    quote = text.find('’', position + 1, run)
+    quote = run if quote == -1 else quote
+    before = GAME_BEFORE_QUOTE.match(text, position + 1, quote)
+    if before is not None:
+        # Only a word character just after the ’ continues the name
+        if before.end() < quote or quote + 1 >= run or GAME_WORD.match(text, quote + 1) is None:
+            return before.end()
+        after = GAME_AFTER_QUOTE.match(text, quote + 1, run)
+    else:
+        after = GAME_AFTER_QUOTE.match(text, quote, run)
+    return -1 if after is None else after.end()
+
+def scan_game(lang, text, discards, position=0):
+    match = GAME.match
+    end = len(text)
+    while position < end:
+        m = match(text, position)
+        if m is None:
+            raise not_lexed(lang, text, position)
+        typ = m.lastgroup
+        stop = m.end()
+        if typ == 'name':
+            stop = end_of_name(text, position)
+            if stop == -1 or text[stop - 1] == ':':
+                raise not_lexed(lang, text, position)
+            typ = 'year' if stop - position == 4 and GAME_YEAR.match(text, position) is not None else 'normal'
+        if typ not in discards:
+            yield typ, position, stop
+        position = stop
+
+# Language name => scanner(language, text, discards, position) yielding the type, start and end of the tokens
+SCANNERS = {
+    'game': scan_game,
+    'json': scan_json,
+    'text': scan_text,
+}
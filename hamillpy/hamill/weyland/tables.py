@@ -0,0 +1,159 @@
+# -----------------------------------------------------------
+# MIT Licence (Expat License Wording)
+# -----------------------------------------------------------
+# Copyright © 2020, Damien Gouteux
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# For more information about my projects see:
+# https://xitog.github.io/dgx (in French)
+
+"""Tables: saves the compiled tables of a language on disk and loads them in new processes
+
+The tables are opt-in: nothing is written on disk unless the environment variable
+WEYLAND_CACHE_DIR gives their directory, for example ~/.cache/weyland.
+"""
+
+#-------------------------------------------------------------------------------
+# Imports
+#-------------------------------------------------------------------------------
+
+import hashlib
+import marshal
+import os
+import re
+import sys
+
+try:
+    import _sre
+    try:
+        from re import _compiler as sre_compile, _parser as sre_parse
+    except ImportError:
+        import sre_compile, sre_parse
+except ImportError:
+    _sre = None
+
+#-------------------------------------------------------------------------------
+# Globals and constants
+#-------------------------------------------------------------------------------
+
+# Directory of the tables, set by WEYLAND_CACHE_DIR. None or an empty string disables them.
+CACHE_DIR = os.environ.get('WEYLAND_CACHE_DIR')
+
+# Version of the content of a tables file. Increment it when save or load change.
+TABLES_FORMAT = 2
+
+# The dispatch masters of these characters are compiled before saving the tables, the others at runtime
+SAVED_CHARACTERS = 256
+
+#-------------------------------------------------------------------------------
+# Functions
+#-------------------------------------------------------------------------------
+
+def enabled():
+    return _sre is not None and CACHE_DIR is not None and CACHE_DIR != ''
+
+def definitions_hash(lang):
+    """Hash of the definitions and blocks of a language, of the format of the tables and of the regex engine able to run the compiled code"""
+    from weyland import __version__
+    sources = []
+    for typ, variants in lang.sources.items():
+        for pattern in variants:
+            if isinstance(pattern, re.Pattern):
+                sources.append((typ, pattern.pattern, pattern.flags))
+            else:
+                sources.append((typ, pattern))
+    # The blocks are not in the tables, but they change the tokens: the HighlightStore of hamill uses this hash
+    blocks = list(lang.block_sources.items())
+    magic = None if _sre is None else _sre.MAGIC
+    key = repr((__version__, TABLES_FORMAT, sys.implementation.cache_tag, magic, lang.name, sources, blocks))
+    return hashlib.sha256(key.encode('utf8')).hexdigest()[:16]
+
+def get_path(lang):
+    return os.path.join(CACHE_DIR, f'{lang.name}-{definitions_hash(lang)}.tables')
+
+def dump_pattern(pattern):
+    """Return the compiled code of a pattern as a marshallable tuple"""
+    parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    code = [int(op) for op in sre_compile._code(parsed, pattern.flags)]
+    return (pattern.pattern, int(pattern.flags), code, parsed.state.groups - 1, dict(parsed.state.groupdict))
+
+def load_pattern(record):
+    """Rebuild a pattern from its compiled code without parsing it again"""
+    source, flags, code, groups, groupindex = record
+    indexgroup = [None] * (groups + 1)
+    for name, index in groupindex.items():
+        indexgroup[index] = name
+    return _sre.compile(source, flags, code, groups, groupindex, tuple(indexgroup))
+
+def save(lang):
+    """Write the compiled tables of lang in CACHE_DIR. Return the path or None if the tables are disabled."""
+    if not enabled():
+        return None
+    for code in range(SAVED_CHARACTERS):
+        lang.get_dispatch_master(chr(code))
+    tables = {
+        'definitions': {typ: [dump_pattern(p) for p in variants] for typ, variants in lang.definitions.items()},
+        'scans': [dump_pattern(scan) for _, _, scan in lang.variants],
+        'firsts': lang.firsts,
+        'literals': lang.literals,
+        'dispatch': lang.dispatch,
+        'masters': [(candidates, dump_pattern(master), groups, regexes, literal_group)
+                    for candidates, (master, groups, regexes, literal_group) in lang.masters.items()],
+    }
+    path = get_path(lang)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # Write then rename so a concurrent process never reads a partial file
+        temp = f'{path}.{os.getpid()}.tmp'
+        with open(temp, 'wb') as f:
+            marshal.dump(tables, f)
+        os.replace(temp, path)
+    except OSError:
+        return None
+    return path
+
+def load(lang):
+    """Set the compiled tables of lang from CACHE_DIR. Return False if they are not available."""
+    if not enabled():
+        return False
+    try:
+        with open(get_path(lang), 'rb') as f:
+            tables = marshal.loads(f.read())
+        definitions = {typ: [load_pattern(r) for r in records] for typ, records in tables['definitions'].items()}
+        variants = []
+        scans = tables['scans']
+        for typ, patterns in definitions.items():
+            for elem in patterns:
+                variants.append((typ, elem, load_pattern(scans[len(variants)])))
+        firsts = tables['firsts']
+        literals = tables['literals']
+        dispatch = tables['dispatch']
+        masters = {candidates: (load_pattern(record), groups, regexes, literal_group)
+                   for candidates, record, groups, regexes, literal_group in tables['masters']}
+    except (OSError, EOFError, ValueError, TypeError, KeyError, IndexError, RuntimeError):
+        return False
+    lang.variants = variants
+    lang.dispatch = dispatch
+    lang.masters = masters
+    lang.firsts = firsts
+    lang.literals = literals
+    lang.index_literals()
+    lang.definitions = definitions
+    return True